@@ -0,0 +1,499 @@
+#!/usr/bin/python
+
+'''
+This script is meant to be imported for its functionality. However, a standalone
+behavior does exist. It is a differential harness that checks optimized versions of the
+lane detection stages against the reference implementations that ship today
+(lane_detection.find_lane_points, line.ransac_line2d, line.Line.intersection,
+lane_detection.detect_lanes_in_edges, and the pose step as originally written in
+lane_pose_estimation) by running both side by side on synthetic and recorded frames.
+
+Deterministic stages (the lane point search, the line intersection, and the pose step)
+must match the reference exactly and every mismatching case is reported. Stochastic
+stages (RANSAC and full detection) are run with the same seeds for the reference and the
+candidate and must agree at the distribution level: for every case the median line
+parameters must be within tolerance and the failure rates must be close. Every report
+also contains the speedup ratio of the candidate over the reference, but a candidate
+only passes if its answers agree.
+
+Standalone behavior is to check the fast paths currently in the tree (the frame
+processor, the RANSAC line fitter, and the edge archive lane point search) and exit with
+a non-zero status if any fails.
+
+EXAMPLE
+
+./cv python ./differential_harness.py
+
+LICENSE
+
+Copyright (c) 2012 Viet Nguyen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+'''
+
+import math
+import os
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import edge_archive
+import intrinsic_calibration
+import lane_detection
+from frame_processor import FrameProcessor
+from line import Line, RansacLineFitter, ransac_line2d
+
+def reference_horizontal_drift(left_lane_line, right_lane_line, intrinsic_matrix, distortion_coefficients):
+	'''
+	The pose step exactly as it was written in lane_pose_estimation before the frame
+	processor existed. Returns the horizontal drift, or None if solvePnP failed.
+	'''
+	bottom_image_line = Line(np.matrix([[0],[480]]), np.matrix([[1],[0]]))
+	bottom_left = Line.intersection(left_lane_line, bottom_image_line)
+	bottom_right = Line.intersection(right_lane_line, bottom_image_line)
+
+	almost_bottom_image_line = Line(np.matrix([[0],[480-150]]), np.matrix([[1],[0]]))
+	almost_bottom_left = Line.intersection(left_lane_line, almost_bottom_image_line)
+	almost_bottom_right = Line.intersection(right_lane_line, almost_bottom_image_line)
+
+	object_points = np.array([
+		[-1.6, 0, 0],
+		[1.6, 0, 0],
+		[-1.6, 4.0, 0],
+		[1.6, 4.0, 0],
+	])
+
+	image_points = np.array([
+		bottom_left.T.A[0],
+		bottom_right.T.A[0],
+		almost_bottom_left.T.A[0],
+		almost_bottom_right.T.A[0],
+	])
+
+	solve_pnp_results = cv2.solvePnP(
+		object_points,
+		image_points,
+		intrinsic_matrix,
+		distortion_coefficients,
+	)
+
+	pnp_success, rotation_omega, translate = solve_pnp_results
+	if not pnp_success:
+		return None
+	return -translate[0][0]
+
+def synthetic_frame(seed, width = 640, height = 480, lanes = ('left', 'right'), num_of_speckles = 200):
+	'''
+	Draws a synthetic road frame: two lane markings converging on a randomly placed
+	vanishing point plus random speckle noise. The markings are placed so that they
+	cross the homework 4 search strips (see define_hw4_search_strips) along their whole
+	height. The lanes argument lists the markings to draw, so that frames with one or no
+	lane can be made, and num_of_speckles is the number of noise pixels. The seed makes
+	the frame repeatable.
+	'''
+	rng = random.Random(seed)
+	cv_image = np.zeros((height, width, 3), dtype = np.uint8)
+
+	# the homework 4 strip centers meet around (242, 183) and reach x = -15 and x = 440
+	# at row 368; jitter both a little and pick the lane positions at row 368 from
+	# inside the strips
+	vanishing_point = (242+rng.randint(-10, 10), 183+rng.randint(-8, 8))
+	lane_positions = {'left': 45+rng.randint(-25, 25), 'right': 440+rng.randint(-25, 25)}
+	for lane in lanes:
+		x_at_368 = lane_positions[lane]
+		x_at_bottom = vanishing_point[0]+(x_at_368-vanishing_point[0])*(height-vanishing_point[1])//(368-vanishing_point[1])
+		cv2.line(cv_image, vanishing_point, (x_at_bottom, height), (255, 255, 255), 4)
+
+	for speckle in range(num_of_speckles):
+		x, y = rng.randint(0, width-1), rng.randint(0, height-1)
+		cv_image[y, x] = (255, 255, 255)
+
+	return cv_image
+
+def load_frames(num_of_synthetic_frames = 16, image_paths = [], num_of_sparse_frames = 3):
+	'''
+	Returns a list of (name, image) 2-tuples with the given number of synthetic frames,
+	then num_of_sparse_frames synthetic frames without noise with only the left lane, only
+	the right lane, or no lane in turn, followed by every image in image_paths that could
+	be read.
+	'''
+	frames = [('synthetic {0}'.format(seed), synthetic_frame(seed)) for seed in range(num_of_synthetic_frames)]
+	sparse_lanes = [('left',), ('right',), ()]
+	for seed in range(num_of_sparse_frames):
+		lanes = sparse_lanes[seed % len(sparse_lanes)]
+		name = 'synthetic {0} with {1}'.format(seed, ' and '.join(lanes) if lanes else 'no lanes')
+		frames.append((name, synthetic_frame(seed, lanes = lanes, num_of_speckles = 0)))
+	for image_path in image_paths:
+		cv_image = cv2.imread(image_path)
+		if cv_image is not None:
+			frames.append((os.path.basename(image_path), cv_image))
+	return frames
+
+def line_parameters(line):
+	'''
+	Returns the (theta, rho) normal form of a Line so that lines can be compared no
+	matter which origin and direction sign RANSAC picked.
+	'''
+	x, y = line.origin[0, 0], line.origin[1, 0]
+	a, b = line.unit_dir[0, 0], line.unit_dir[1, 0]
+	if b < 0 or (b == 0 and a < 0):
+		a, b = -a, -b
+	return math.atan2(b, a), -b*x+a*y
+
+def median(values):
+	'''
+	Returns the median of a non-empty list of numbers.
+	'''
+	values = sorted(values)
+	middle = len(values)//2
+	if len(values) % 2:
+		return values[middle]
+	return (values[middle-1]+values[middle])/2.0
+
+class Report():
+	'''
+	The outcome of comparing a candidate with the reference on one stage. The candidate
+	passed if there are no mismatches; each mismatch is a (case, detail) 2-tuple. The
+	times are None if the stage was not timed.
+	'''
+
+	def __init__(self, stage, num_of_cases, mismatches, reference_time, candidate_time):
+		'''
+		Creates a report.
+		'''
+		self.stage = stage
+		self.num_of_cases = num_of_cases
+		self.mismatches = mismatches
+		self.reference_time = reference_time
+		self.candidate_time = candidate_time
+
+	def passed(self):
+		'''
+		Returns True if the candidate agreed with the reference on every case.
+		'''
+		return len(self.mismatches) == 0
+
+	def speedup(self):
+		'''
+		Returns how many times faster the candidate was than the reference, or None if
+		the stage was not timed.
+		'''
+		if self.reference_time == None or self.candidate_time == None:
+			return None
+		if self.candidate_time <= 0:
+			return float('inf')
+		return self.reference_time/self.candidate_time
+
+	def __str__(self):
+		'''
+		Returns a human readable summary including up to five mismatches.
+		'''
+		speedup = self.speedup()
+		lines = ['{0}: {1} ({2} cases, {3} mismatches, {4})'.format(
+			self.stage,
+			'PASS' if self.passed() else 'FAIL',
+			self.num_of_cases,
+			len(self.mismatches),
+			'not timed' if speedup == None else '{0:.2f}x speedup'.format(speedup),
+		)]
+		for case, detail in self.mismatches[:5]:
+			lines.append('  {0}: {1}'.format(case, detail))
+		return '\n'.join(lines)
+
+def best_time(run, repeats):
+	'''
+	Calls run repeats times and returns the shortest time in seconds a call took.
+	'''
+	best = float('inf')
+	for repeat in range(repeats):
+		start_time = time.time()
+		run()
+		best = min(best, time.time()-start_time)
+	return best
+
+def compare_deterministic(stage, reference, candidate, cases, equal, repeats = 5):
+	'''
+	Runs reference and candidate on every case and reports every case where equal
+	returns False. Each case is a (name, arguments) 2-tuple; the arguments are passed to
+	both functions. The first run of each side also serves as a warm-up; the times in
+	the report are the best of repeats further runs over all cases. If repeats is 0 the
+	stage is not timed.
+	'''
+	reference_results = [reference(*arguments) for name, arguments in cases]
+	candidate_results = [candidate(*arguments) for name, arguments in cases]
+
+	reference_time = None
+	candidate_time = None
+	if repeats > 0:
+		reference_time = best_time(lambda: [reference(*arguments) for name, arguments in cases], repeats)
+		candidate_time = best_time(lambda: [candidate(*arguments) for name, arguments in cases], repeats)
+
+	mismatches = []
+	for (name, arguments), reference_result, candidate_result in zip(cases, reference_results, candidate_results):
+		if not equal(reference_result, candidate_result):
+			mismatches.append((name, 'expected {0!r}, got {1!r}'.format(reference_result, candidate_result)))
+
+	return Report(stage, len(cases), mismatches, reference_time, candidate_time)
+
+def compare_stochastic(stage, reference, candidate, cases, describe, seeds = range(20), tolerances = (0.02, 2.0), max_failure_rate_difference = 0.1, repeats = 2):
+	'''
+	Runs reference and candidate on every case once per seed, seeding the random module
+	identically before each run. The describe function turns a result into a tuple of
+	numbers, or None for a failed result. A case matches if the failure rates differ by
+	at most max_failure_rate_difference and the median of every number is within the
+	corresponding tolerance. As in compare_deterministic, the first run of each side is
+	a warm-up and the times are the best of repeats further runs.
+	'''
+	seeds = list(seeds)
+
+	def run(function):
+		descriptions = []
+		for name, arguments in cases:
+			case_descriptions = []
+			for seed in seeds:
+				random.seed(seed)
+				case_descriptions.append(describe(function(*arguments)))
+			descriptions.append(case_descriptions)
+		return descriptions
+
+	reference_descriptions = run(reference)
+	candidate_descriptions = run(candidate)
+
+	reference_time = best_time(lambda: run(reference), repeats)
+	candidate_time = best_time(lambda: run(candidate), repeats)
+
+	mismatches = []
+	for (name, arguments), reference_case, candidate_case in zip(cases, reference_descriptions, candidate_descriptions):
+		reference_found = [d for d in reference_case if d != None]
+		candidate_found = [d for d in candidate_case if d != None]
+
+		failure_rate_difference = abs(len(reference_found)-len(candidate_found))/float(len(seeds))
+		if failure_rate_difference > max_failure_rate_difference:
+			mismatches.append((name, 'found {0}/{2} times, reference found {1}/{2} times'.format(len(candidate_found), len(reference_found), len(seeds))))
+			continue
+
+		if not reference_found or not candidate_found:
+			continue
+
+		for component, tolerance in enumerate(tolerances):
+			reference_median = median([d[component] for d in reference_found])
+			candidate_median = median([d[component] for d in candidate_found])
+			if abs(reference_median-candidate_median) > tolerance:
+				mismatches.append((name, 'median of parameter {0} is {1!r}, reference is {2!r}'.format(component, candidate_median, reference_median)))
+				break
+
+	return Report(stage, len(cases), mismatches, reference_time, candidate_time)
+
+def check_find_lane_points(candidate, canny_frames, left_search_strips, right_search_strips, stage = 'find_lane_points'):
+	'''
+	Checks a candidate for lane_detection.find_lane_points, which must return exactly
+	the same list of points. The stage argument names the report.
+	'''
+	cases = []
+	for name, canny_image in canny_frames:
+		cases.append((name+' left', (canny_image, left_search_strips, 'left')))
+		cases.append((name+' right', (canny_image, right_search_strips, 'right')))
+	equal = lambda a, b: [tuple(p) for p in a] == [tuple(p) for p in b]
+	return compare_deterministic(stage, lane_detection.find_lane_points, candidate, cases, equal)
+
+def check_intersection(candidate, line_pairs, stage = 'Line.intersection'):
+	'''
+	Checks a candidate for Line.intersection, which must return exactly the same point
+	(or None for parallel lines). The stage argument names the report.
+	'''
+	cases = [('line pair {0}'.format(i), line_pair) for i, line_pair in enumerate(line_pairs)]
+	def equal(a, b):
+		if a is None or b is None:
+			return a is None and b is None
+		return np.array_equal(np.asarray(a), np.asarray(b))
+	return compare_deterministic(stage, Line.intersection, candidate, cases, equal)
+
+def check_ransac(candidate, point_sets, num_of_iterations = 100, tolerance = 4.0, seeds = range(20), stage = 'ransac_line2d'):
+	'''
+	Checks a candidate for ransac_line2d at the distribution level over the given seeds.
+	The stage argument names the report.
+	'''
+	cases = [('point set {0}'.format(i), (points, num_of_iterations, tolerance)) for i, points in enumerate(point_sets)]
+	describe = lambda line: None if line is None else line_parameters(line)
+	return compare_stochastic(stage, ransac_line2d, candidate, cases, describe, seeds)
+
+def check_detection(candidate, canny_frames, left_search_strips, right_search_strips, seeds = range(10)):
+	'''
+	Checks a candidate for lane_detection.detect_lanes_in_edges at the distribution
+	level over the given seeds by comparing the vanishing points. The reference raises
+	IndexError on frames where fewer than two strips of a lane hit an edge, so only pass
+	frames with at least two hits per lane.
+	'''
+	cases = [(name, (canny_image, left_search_strips, right_search_strips)) for name, canny_image in canny_frames]
+	def describe(result):
+		lanes_found, left_lane_line, right_lane_line, vanishing_point = result
+		if not lanes_found or vanishing_point is None:
+			return None
+		return vanishing_point[0, 0], vanishing_point[1, 0]
+	return compare_stochastic('detect_lanes_in_edges', lane_detection.detect_lanes_in_edges, candidate, cases, describe, seeds, (4.0, 4.0))
+
+def check_sparse_detection(candidate, canny_frames, left_search_strips, right_search_strips):
+	'''
+	Checks that a candidate for lane_detection.detect_lanes_in_edges returns exactly
+	(False, None, None, None), lanes not found, on frames where fewer than two strips of
+	a lane hit an edge. The reference raises IndexError on such frames, so the expected
+	result stands in for it and the stage is not timed.
+	'''
+	cases = [(name, (canny_image, left_search_strips, right_search_strips)) for name, canny_image in canny_frames]
+	expected = lambda canny_image, left_search_strips, right_search_strips: (False, None, None, None)
+	def equal(a, b):
+		return len(a) == len(b) and all([x is y for x, y in zip(a, b)])
+	return compare_deterministic('detect_lanes_in_edges on sparse frames', expected, candidate, cases, equal, repeats = 0)
+
+def check_pose(candidate, line_pairs, intrinsic_matrix, distortion_coefficients):
+	'''
+	Checks a candidate for the pose step, which must return exactly the same horizontal
+	drift as reference_horizontal_drift.
+	'''
+	cases = [('lane pair {0}'.format(i), (left, right, intrinsic_matrix, distortion_coefficients)) for i, (left, right) in enumerate(line_pairs)]
+	return compare_deterministic('pose', reference_horizontal_drift, candidate, cases, lambda a, b: a == b)
+
+def find_lane_points_into_candidate(canny_image, search_strips, lane):
+	'''
+	Adapts lane_detection.find_lane_points_into to the find_lane_points signature.
+	'''
+	lane_points = np.zeros((len(search_strips), 2), dtype = np.int32)
+	count = lane_detection.find_lane_points_into(canny_image, search_strips, lane, lane_points)
+	return [(int(x), int(y)) for x, y in lane_points[:count]]
+
+def edge_archive_candidate(canny_image, search_strips, lane):
+	'''
+	Adapts edge_archive.find_lane_points_in_bits to the find_lane_points signature by
+	packing and unpacking the strip bits the same way an edge archive does.
+	'''
+	strip_bits = []
+	for search_strip in search_strips:
+		x, y = search_strip.left_point
+		packed = np.packbits(canny_image[y, x:x+search_strip.width+1] == 255)
+		strip_bits.append(np.unpackbits(packed)[:search_strip.width+1].astype(bool))
+	return edge_archive.find_lane_points_in_bits(strip_bits, search_strips, lane)
+
+def frame_processor_detection_candidate(left_search_strips, right_search_strips):
+	'''
+	Returns a candidate for detect_lanes_in_edges backed by a single FrameProcessor, so
+	that buffer reuse across frames is exercised.
+	'''
+	processor = FrameProcessor(left_search_strips, right_search_strips)
+	return lambda canny_image, left, right: processor.detect_lanes_in_edges(canny_image)
+
+def ransac_line_fitter_candidate(max_num_of_points = 16):
+	'''
+	Returns a candidate for ransac_line2d backed by a single RansacLineFitter per
+	(num_of_iterations, tolerance) pair, so that buffer reuse across calls is exercised.
+	'''
+	line_fitters = {}
+	points_buffer = np.zeros((max_num_of_points, 2), dtype = np.int32)
+	def candidate(points, num_of_iterations, tolerance):
+		key = (num_of_iterations, tolerance)
+		if key not in line_fitters:
+			line_fitters[key] = RansacLineFitter(max_num_of_points, num_of_iterations, tolerance)
+		points_buffer[:len(points)] = points
+		return line_fitters[key].fit(points_buffer, len(points))
+	return candidate
+
+def frame_processor_pose_candidate(height = 480, width = 640):
+	'''
+	Returns a candidate for the pose step backed by a single FrameProcessor.
+	'''
+	processor = FrameProcessor([], [])
+	processor.set_resolution(height, width)
+	def candidate(left_lane_line, right_lane_line, intrinsic_matrix, distortion_coefficients):
+		pnp_success, rotation_omega, translate = processor.estimate_pose(left_lane_line, right_lane_line, intrinsic_matrix, distortion_coefficients)
+		if not pnp_success:
+			return None
+		return processor.horizontal_drift()
+	return candidate
+
+def hw4_differential_harness(num_of_synthetic_frames = 16, num_of_recorded_frames = 32, num_of_sparse_frames = 3, include_self_checks = False):
+	'''
+	Checks the fast paths in the tree against the reference on synthetic frames (see
+	load_frames) and a subset of the homework 4 test sequence (if present). Uses the homework 4 calibration
+	if the calibration images are present and a nominal pinhole camera otherwise.
+	Returns the list of reports.
+
+	There is no fast path for Line.intersection in the tree yet, and find_lane_points is
+	itself a wrapper around find_lane_points_into. If include_self_checks is True these
+	stages and ransac_line2d are also checked against themselves, which only validates
+	the harness; those reports are labelled as self-checks and their speedups are
+	meaningless.
+	'''
+	image_paths = ['LDWS_test/LDWS_test_data {0:03}.bmp'.format(x) for x in range(1, 609)]
+	image_paths = image_paths[::max(1, len(image_paths)//max(1, num_of_recorded_frames))][:num_of_recorded_frames]
+
+	if os.path.isdir('LDWS_calibrate'):
+		intrinsic_matrix, distortion_coefficients = intrinsic_calibration.hw4_calibration(False)
+	else:
+		intrinsic_matrix = np.array([[500.0, 0, 320.0], [0, 500.0, 240.0], [0, 0, 1.0]])
+		distortion_coefficients = np.zeros(5)
+
+	left_search_strips, right_search_strips = lane_detection.define_hw4_search_strips()
+
+	frames = load_frames(num_of_synthetic_frames, image_paths, num_of_sparse_frames)
+	canny_frames = [(name, cv2.Canny(cv_image, 100, 300)) for name, cv_image in frames]
+
+	# lane points and fitted lines from the reference, used as inputs to later stages.
+	# the reference RANSAC needs at least two points, so frames with fewer strip hits on
+	# either side are checked separately from the detection stage
+	point_sets = []
+	line_pairs = []
+	detection_frames = []
+	sparse_frames = []
+	random.seed(0)
+	for name, canny_image in canny_frames:
+		left_lane_points = lane_detection.find_lane_points(canny_image, left_search_strips, 'left')
+		right_lane_points = lane_detection.find_lane_points(canny_image, right_search_strips, 'right')
+		point_sets.extend([points for points in [left_lane_points, right_lane_points] if len(points) >= 2])
+		if len(left_lane_points) < 2 or len(right_lane_points) < 2:
+			sparse_frames.append((name, canny_image))
+			continue
+		detection_frames.append((name, canny_image))
+		lanes_found, left_lane_line, right_lane_line, vanishing_point = \
+			lane_detection.detect_lanes_in_edges(canny_image, left_search_strips, right_search_strips)
+		if lanes_found:
+			line_pairs.append((left_lane_line, right_lane_line))
+
+	reports = [
+		check_find_lane_points(edge_archive_candidate, canny_frames, left_search_strips, right_search_strips, 'find_lane_points_in_bits'),
+		check_ransac(ransac_line_fitter_candidate(max(len(left_search_strips), len(right_search_strips))), point_sets, stage = 'RansacLineFitter'),
+		check_detection(frame_processor_detection_candidate(left_search_strips, right_search_strips), detection_frames, left_search_strips, right_search_strips),
+		check_sparse_detection(frame_processor_detection_candidate(left_search_strips, right_search_strips), sparse_frames, left_search_strips, right_search_strips),
+		check_pose(frame_processor_pose_candidate(), line_pairs, intrinsic_matrix, distortion_coefficients),
+	]
+	if include_self_checks:
+		reports.extend([
+			check_find_lane_points(find_lane_points_into_candidate, canny_frames, left_search_strips, right_search_strips, 'find_lane_points_into (self-check)'),
+			check_intersection(Line.intersection, line_pairs, 'Line.intersection (self-check)'),
+			check_ransac(ransac_line2d, point_sets, stage = 'ransac_line2d (self-check)'),
+		])
+	return reports
+
+if __name__ == '__main__':
+	reports = hw4_differential_harness()
+
+	for report in reports:
+		print(report)
+
+	if not all([report.passed() for report in reports]):
+		sys.exit(1)
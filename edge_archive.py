@@ -0,0 +1,275 @@
+#!/usr/bin/python
+
+'''
+This script is meant to be imported for its functionality. However, a standalone
+behavior does exist. It provides a compact archive format for re-analysing a drive
+without keeping the full frames around. find_lane_points only ever reads the Canny image
+pixels under the search strips, so for each frame the archive stores only those edge
+bits, bit-packed per strip row. A replay path feeds the bits straight into the lane
+point search and RANSAC without decoding any images. For the homework 4 strips a frame
+takes a few hundred bytes instead of the roughly 900 KB of a BMP frame.
+
+FORMAT
+
+All numbers are little-endian. The header is the magic bytes 'LEA1', the Canny
+low_threshold and ratio used (float64 each), the number of left and right strips (uint16
+each), and then the left strips followed by the right strips, each as its left point x,
+y, and width (int16 each). Every frame record that follows has the same size: the frame
+index (uint32) followed by, for every strip in header order, the edge bits of its width+1
+pixels from left to right, packed with numpy.packbits.
+
+Standalone behavior is to archive the homework 4 test sequence into LDWS_test.lea (if it
+does not exist yet), replay it, and print the archive size per frame and the detection
+rate.
+
+EXAMPLE
+
+./cv python ./edge_archive.py
+
+LICENSE
+
+Copyright (c) 2012 Viet Nguyen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+'''
+
+import os
+import struct
+
+import cv2
+import numpy as np
+
+import lane_detection
+from lane_detection import LaneSearchStrip, fit_lanes
+
+ARCHIVE_MAGIC = b'LEA1'
+
+# magic, low_threshold, ratio, number of left strips, number of right strips
+HEADER_FORMAT = '<4sddHH'
+
+# left point x, left point y, width
+STRIP_FORMAT = '<hhh'
+
+# frame index
+RECORD_HEADER_FORMAT = '<I'
+
+def strip_row_size(search_strip):
+	'''
+	Returns the number of bytes a strip's packed edge bits take in a frame record.
+	'''
+	return (search_strip.width+1+7)//8
+
+class EdgeArchiveWriter():
+	'''
+	Writes an edge archive one frame at a time.
+	'''
+
+	def __init__(self, archive_path, left_search_strips, right_search_strips, low_threshold = 100, ratio = 3):
+		'''
+		Creates the archive at archive_path and writes its header. The strips are the
+		ones whose edge bits will be stored and the Canny knobs are recorded for
+		reference; they should be the ones the Canny images passed to write were made
+		with. Both knobs are stored as floats, so non-integer values are kept as-is.
+		'''
+		self.search_strips = list(left_search_strips)+list(right_search_strips)
+		self.archive_file = open(archive_path, 'wb')
+		self.archive_file.write(struct.pack(
+			HEADER_FORMAT,
+			ARCHIVE_MAGIC,
+			low_threshold,
+			ratio,
+			len(left_search_strips),
+			len(right_search_strips),
+		))
+		for search_strip in self.search_strips:
+			x, y = search_strip.left_point
+			self.archive_file.write(struct.pack(STRIP_FORMAT, x, y, search_strip.width))
+
+	def write(self, frame_index, canny_image):
+		'''
+		Appends the edge bits of a Canny image under the strips as a frame record.
+		'''
+		self.archive_file.write(struct.pack(RECORD_HEADER_FORMAT, frame_index))
+		for search_strip in self.search_strips:
+			x, y = search_strip.left_point
+			edge_bits = canny_image[y, x:x+search_strip.width+1] == 255
+			self.archive_file.write(np.packbits(edge_bits).tobytes())
+
+	def close(self):
+		'''
+		Closes the archive file.
+		'''
+		self.archive_file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+class EdgeArchiveReader():
+	'''
+	Reads an edge archive. Iterating over the reader yields a (frame index, strip bits)
+	2-tuple per frame where the strip bits are a list with one NumPy Boolean array per
+	strip (left strips first) holding its width+1 edge bits from left to right.
+	'''
+
+	def __init__(self, archive_path):
+		'''
+		Opens the archive at archive_path and reads its header into the
+		left_search_strips, right_search_strips, low_threshold, and ratio attributes.
+		Raises IOError if the file is not an edge archive.
+		'''
+		self.archive_file = open(archive_path, 'rb')
+
+		header = self.archive_file.read(struct.calcsize(HEADER_FORMAT))
+		if len(header) != struct.calcsize(HEADER_FORMAT) or header[:4] != ARCHIVE_MAGIC:
+			self.archive_file.close()
+			raise IOError('"{0}" is not an edge archive!'.format(archive_path))
+		magic, self.low_threshold, self.ratio, num_of_left_strips, num_of_right_strips = \
+			struct.unpack(HEADER_FORMAT, header)
+
+		search_strips = []
+		for i in range(num_of_left_strips+num_of_right_strips):
+			x, y, width = struct.unpack(STRIP_FORMAT, self.archive_file.read(struct.calcsize(STRIP_FORMAT)))
+			search_strips.append(LaneSearchStrip((x, y), width))
+		self.left_search_strips = search_strips[:num_of_left_strips]
+		self.right_search_strips = search_strips[num_of_left_strips:]
+
+		self.row_sizes = [strip_row_size(search_strip) for search_strip in search_strips]
+		self.record_size = struct.calcsize(RECORD_HEADER_FORMAT)+sum(self.row_sizes)
+
+	def __iter__(self):
+		'''
+		Yields the frames of the archive in order.
+		'''
+		search_strips = self.left_search_strips+self.right_search_strips
+		header_size = struct.calcsize(RECORD_HEADER_FORMAT)
+		while True:
+			record = self.archive_file.read(self.record_size)
+			if len(record) < self.record_size:
+				return
+
+			frame_index, = struct.unpack(RECORD_HEADER_FORMAT, record[:header_size])
+			packed = np.frombuffer(record, dtype = np.uint8, offset = header_size)
+
+			strip_bits = []
+			offset = 0
+			for search_strip, row_size in zip(search_strips, self.row_sizes):
+				bits = np.unpackbits(packed[offset:offset+row_size])[:search_strip.width+1]
+				strip_bits.append(bits.astype(bool))
+				offset += row_size
+
+			yield frame_index, strip_bits
+
+	def close(self):
+		'''
+		Closes the archive file.
+		'''
+		self.archive_file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+def find_lane_points_in_bits(strip_bits, search_strips, lane):
+	'''
+	Finds the same points as lane_detection.find_lane_points but from the archived edge
+	bits of the search strips instead of a Canny image. The first argument is the list
+	of edge bit arrays of the strips in search_strips; the lane argument is 'left' or
+	'right' as in find_lane_points.
+	'''
+	assert(lane == 'left' or lane == 'right')
+
+	lane_points = []
+	for bits, search_strip in zip(strip_bits, search_strips):
+		edge_offsets = np.flatnonzero(bits)
+		if len(edge_offsets) == 0:
+			continue
+
+		# the left lane is searched from the right end of the strip and the right lane
+		# from the left end, so the first edge hit is the last or first set bit
+		x, y = search_strip.left_point
+		if lane == 'left':
+			x += int(edge_offsets[-1])
+		else:
+			x += int(edge_offsets[0])
+		lane_points.append((x, y))
+
+	return lane_points
+
+def replay_archive(archive_path, num_of_iterations = 100, tolerance = 4.0):
+	'''
+	Replays an edge archive through the lane point search and RANSAC. Yields a 2-tuple
+	per frame containing the frame index and the same 4-tuple detect_lanes returns.
+	Frames where fewer than two strips of a lane hit an edge are yielded as lanes not
+	found since RANSAC needs at least two points.
+	'''
+	with EdgeArchiveReader(archive_path) as reader:
+		num_of_left_strips = len(reader.left_search_strips)
+		for frame_index, strip_bits in reader:
+			left_lane_points = find_lane_points_in_bits(strip_bits[:num_of_left_strips], reader.left_search_strips, 'left')
+			right_lane_points = find_lane_points_in_bits(strip_bits[num_of_left_strips:], reader.right_search_strips, 'right')
+			if len(left_lane_points) < 2 or len(right_lane_points) < 2:
+				yield frame_index, (False, None, None, None)
+				continue
+			yield frame_index, fit_lanes(left_lane_points, right_lane_points, num_of_iterations, tolerance)
+
+def archive_sequence(image_paths, archive_path, left_search_strips, right_search_strips, low_threshold = 100, ratio = 3):
+	'''
+	Runs Canny on every image in image_paths and writes the edge bits under the strips
+	into a new archive at archive_path. Images that cannot be read are skipped; their
+	frame index is the position in image_paths.
+	'''
+	with EdgeArchiveWriter(archive_path, left_search_strips, right_search_strips, low_threshold, ratio) as writer:
+		for frame_index, image_path in enumerate(image_paths):
+			cv_image = cv2.imread(image_path)
+			if cv_image is None:
+				continue
+			writer.write(frame_index, cv2.Canny(cv_image, low_threshold, low_threshold*ratio))
+
+def hw4_edge_archive(archive_path = 'LDWS_test.lea'):
+	'''
+	Archives the homework 4 test sequence if needed, replays it, and prints the archive
+	size per frame and the detection rate.
+	'''
+	if not os.path.exists(archive_path):
+		image_paths = ['LDWS_test/LDWS_test_data {0:03}.bmp'.format(x) for x in range(1, 609)]
+		left_search_strips, right_search_strips = lane_detection.define_hw4_search_strips()
+		archive_sequence(image_paths, archive_path, left_search_strips, right_search_strips)
+
+	num_of_frames = 0
+	num_of_found = 0
+	for frame_index, (lanes_found, left_lane_line, right_lane_line, vanishing_point) in replay_archive(archive_path):
+		num_of_frames += 1
+		if lanes_found:
+			num_of_found += 1
+
+	if num_of_frames == 0:
+		print('ERROR: Archive "{0}" has no frames!'.format(archive_path))
+		return
+
+	print('{0} frames, {1:.1f} bytes per frame, lanes found in {2} frames'.format(
+		num_of_frames,
+		os.path.getsize(archive_path)/float(num_of_frames),
+		num_of_found,
+	))
+
+if __name__ == '__main__':
+	hw4_edge_archive()
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+
+'''
+This script is meant to be imported for its functionality. It provides a cheap per-frame
+fingerprint of the band of the image covered by the lane search strips and a small
+bounded least-recently-used cache that lets near-duplicate frames (such as when the
+vehicle is stopped or moving slowly) reuse the detection and pose results of an earlier
+frame instead of running Canny, the strip search, RANSAC, and solvePnP again.
+
+LICENSE
+
+Copyright (c) 2012 Viet Nguyen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+'''
+
+import collections
+
+import cv2
+import numpy as np
+
+# fingerprint size as (width, height). the height matters as much as the width: thin lane
+# markings are averaged away if too many rows fall into one fingerprint row
+FINGERPRINT_SIZE = (80, 16)
+
+# default cache threshold. the homework 4 test sequence is not part of the tree (see
+# get_files), so this was calibrated on a synthetic 640x480 road frame with the homework
+# 4 lanes: asphalt texture with a standard deviation of 6 levels, 6 px wide markings,
+# and fresh sensor noise with a standard deviation of 2 levels per frame. with
+# FINGERPRINT_SIZE the sensor noise alone measures 0.25 (also with a brightness offset
+# of +1 or +5), a 3 % exposure gain change 0.44, and a lateral shift of 1 px 0.98, 2 px
+# 1.66, and 5 px 3.61. 0.6 hits through noise and exposure flicker while any shift of a
+# pixel or more is a miss; smallest_shift_distance measures 0.83 for 1 px on the same
+# frame. recalibrate with smallest_shift_distance on the real frames
+DEFAULT_THRESHOLD = 0.6
+
+def strip_band(search_strip_sets):
+	'''
+	Returns a 2-tuple containing the top and bottom image rows (inclusive) covered by
+	the given search strip sets. The argument is a list of lists of LaneSearchStrip
+	objects, such as [left_search_strips, right_search_strips].
+	'''
+	rows = [strip.left_point[1] for strips in search_strip_sets for strip in strips]
+	return min(rows), max(rows)
+
+def strip_band_fingerprint(cv_image, band, size = FINGERPRINT_SIZE):
+	'''
+	Computes a fingerprint of the image by downsampling the band of rows given as the
+	2-tuple band (top, bottom) to a tiny grayscale image. The size argument is a 2-tuple
+	containing the width and height of the fingerprint and defaults to
+	FINGERPRINT_SIZE. The return is a NumPy array of type float32 with its mean
+	subtracted, so that a global brightness change such as auto exposure flicker does
+	not change the fingerprint.
+	'''
+	top, bottom = band
+	band_image = cv_image[top:bottom+1]
+	if len(band_image.shape) == 3:
+		band_image = cv2.cvtColor(band_image, cv2.COLOR_BGR2GRAY)
+	fingerprint = cv2.resize(band_image, size, interpolation = cv2.INTER_AREA).astype(np.float32)
+	fingerprint -= fingerprint.mean()
+	return fingerprint
+
+def fingerprint_distance(fingerprint_a, fingerprint_b):
+	'''
+	Returns the mean absolute intensity difference between two fingerprints, in 8-bit
+	intensity levels.
+	'''
+	return np.mean(np.abs(fingerprint_a - fingerprint_b))
+
+def lateral_shift_distance(cv_image, band, shift, size = FINGERPRINT_SIZE):
+	'''
+	Returns the fingerprint distance between an image and the same image shifted to the
+	right by shift pixels. Both are cropped to the columns they have in common, so no
+	made-up columns enter the distance. Use it on a real frame to calibrate the cache
+	threshold: the threshold should be below the distance of the smallest lane shift
+	that must not be hidden by the cache.
+	'''
+	width = cv_image.shape[1]
+	return fingerprint_distance(
+		strip_band_fingerprint(cv_image[:, shift:], band, size),
+		strip_band_fingerprint(cv_image[:, :width-shift], band, size),
+	)
+
+def smallest_shift_distance(cv_images, band, shift = 1, size = FINGERPRINT_SIZE):
+	'''
+	Returns the smallest lateral_shift_distance over the given images, such as a sample
+	of the frames of a drive. A cache threshold below it keeps every lateral shift of
+	shift pixels from reusing a result.
+	'''
+	return min([lateral_shift_distance(cv_image, band, shift, size) for cv_image in cv_images])
+
+class FrameResultCache():
+	'''
+	A bounded least-recently-used cache of per-frame results keyed by strip band
+	fingerprints. A lookup hits if any cached fingerprint is within threshold (as
+	measured by fingerprint_distance) of the query fingerprint. The number of hits and
+	misses are kept in the hits and misses attributes.
+
+	An entry keeps the fingerprint of the frame its result was actually computed from;
+	hits never refresh it. Refreshing would let a slow drift creep along one small step
+	at a time and reuse a stale result indefinitely, whereas this way a reused result is
+	never further than threshold from a frame it was computed on.
+	'''
+
+	def __init__(self, capacity = 8, threshold = DEFAULT_THRESHOLD):
+		'''
+		Creates an empty cache. The capacity argument is the maximum number of results
+		kept and defaults to 8. The threshold argument is the largest mean absolute
+		intensity difference (in 8-bit intensity levels) at which two frames are still
+		considered the same and defaults to DEFAULT_THRESHOLD, which is below the
+		distance of a 1 px lateral lane shift (see smallest_shift_distance).
+		'''
+		self.capacity = capacity
+		self.threshold = threshold
+		self.entries = collections.OrderedDict()
+		self.next_key = 0
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		'''
+		Returns the number of cached results.
+		'''
+		return len(self.entries)
+
+	def lookup(self, fingerprint):
+		'''
+		Returns the cached result for the closest fingerprint within the threshold, or
+		None if there is no such fingerprint. Updates the hit and miss counters and
+		marks the returned entry as most recently used.
+		'''
+		best_key = None
+		best_distance = self.threshold
+		for key, (cached_fingerprint, result) in self.entries.items():
+			distance = fingerprint_distance(fingerprint, cached_fingerprint)
+			if distance <= best_distance:
+				best_key = key
+				best_distance = distance
+
+		if best_key == None:
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		entry = self.entries.pop(best_key)
+		self.entries[best_key] = entry
+		return entry[1]
+
+	def store(self, fingerprint, result):
+		'''
+		Stores a result under the given fingerprint, evicting the least recently used
+		result if the cache is full. The result must not be mutated afterward since it
+		is handed back as-is on a hit.
+		'''
+		self.entries[self.next_key] = (fingerprint, result)
+		self.next_key += 1
+		while len(self.entries) > self.capacity:
+			self.entries.popitem(last = False)
+
+	def hit_rate(self):
+		'''
+		Returns the fraction of lookups that were hits, or 0.0 if there have been no
+		lookups.
+		'''
+		lookups = self.hits + self.misses
+		if lookups == 0:
+			return 0.0
+		return float(self.hits) / lookups
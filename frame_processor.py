@@ -0,0 +1,274 @@
+#!/usr/bin/python
+
+'''
+This script is meant to be imported for its functionality. It provides a frame processor
+that performs the same lane detection and pose estimation as lane_detection.detect_lanes
+and lane_pose_estimation.hw4_lane_pose_estimation but keeps its working buffers (the
+grayscale image, the Canny edge image, the lane point arrays, and the pose arrays) alive
+between frames. Buffers are only allocated when the processor sees a new resolution so
+the steady-state frame loop reuses the same memory through the OpenCV dst/edges output
+arguments and in-place NumPy writes.
+
+RANSAC runs on a line.RansacLineFitter, which scores all iterations at once over its own
+reusable buffers instead of allocating NumPy matrices per point and iteration like
+ransac_line2d, and the pose step intersects the lanes with the image rows in plain
+floats. On a synthetic 640x480 frame where all 16 strips of each lane hit an edge,
+detection plus pose estimation allocates about 20 Python objects per frame (the two Line
+objects, the vanishing point, and small NumPy views and scalars) with a transient peak
+of about 5 KB; ransac_line2d alone used to allocate about 8800 matrices per frame.
+cv2.imread still allocates the decoded frame. Use measure_allocations to check the
+actual cost per frame.
+
+LICENSE
+
+Copyright (c) 2012 Viet Nguyen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+'''
+
+import sys
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+import cv2
+import numpy as np
+
+from lane_detection import find_lane_points_into
+from line import Line, RansacLineFitter
+
+# world metric coordinates of the lane rectangle used for pose estimation. the order
+# matches the image points: bottom left, bottom right, almost bottom left, almost bottom
+# right. the lane is assumed to be 3.2 m wide and the rectangle 4.0 m deep.
+LANE_OBJECT_POINTS = np.array([
+	[-1.6, 0, 0],
+	[1.6, 0, 0],
+	[-1.6, 4.0, 0],
+	[1.6, 4.0, 0],
+])
+
+# pixel offset from the bottom of the image to the second horizontal line the lanes are
+# intersected with
+ALMOST_BOTTOM_OFFSET = 150
+
+def row_intersection(line, row):
+	'''
+	Returns the x coordinate where the line crosses the horizontal image row. This is
+	Line.intersection(line, Line(np.matrix([[0],[row]]), np.matrix([[1],[0]]))) worked
+	out with plain floats in the same order of operations, so the result is bit for bit
+	the same without the NumPy matrix overhead. The line must not be horizontal.
+	'''
+	x1 = float(line.origin[0, 0])
+	y1 = float(line.origin[1, 0])
+	a1 = float(line.unit_dir[0, 0])
+	b1 = float(line.unit_dir[1, 0])
+	return (b1*(0-x1)-a1*(row-y1))/(a1*0-1*b1)
+
+class FrameProcessor():
+	'''
+	Processes a sequence of frames of the same resolution while reusing all of the
+	per-frame buffers. The buffer_allocations attribute counts how many times the
+	processor has (re)allocated its own buffers, which only happens on a resolution
+	change; see measure_allocations for the small remaining per-frame cost.
+	'''
+
+	def __init__(self, left_search_strips, right_search_strips, low_threshold = 100, ratio = 3, grayscale = False, num_of_iterations = 100, tolerance = 4.0):
+		'''
+		Creates a frame processor from the left and right lane search strip sets. The
+		Canny knobs low_threshold and ratio and the RANSAC knobs num_of_iterations and
+		tolerance default to the values used in lane_detection.detect_lanes. If
+		grayscale is True the frames are converted into a reusable grayscale buffer
+		before running Canny; it defaults to False so that the edges match
+		lane_detection.detect_lanes exactly.
+		'''
+		self.left_search_strips = left_search_strips
+		self.right_search_strips = right_search_strips
+		self.low_threshold = low_threshold
+		self.ratio = ratio
+		self.grayscale = grayscale
+		self.num_of_iterations = num_of_iterations
+		self.tolerance = tolerance
+
+		# the resolution the buffers are currently sized for
+		self.shape = None
+
+		# number of times buffers have been (re)allocated
+		self.buffer_allocations = 0
+
+		# lane point buffers only depend on the search strips, not the resolution
+		self.left_lane_points = np.zeros((len(left_search_strips), 2), dtype = np.int32)
+		self.right_lane_points = np.zeros((len(right_search_strips), 2), dtype = np.int32)
+
+		# RANSAC buffers, sized for the largest lane point set
+		self.line_fitter = RansacLineFitter(max(len(left_search_strips), len(right_search_strips), 2), num_of_iterations, tolerance)
+
+		# pose buffers, filled in place every frame
+		self.image_points = np.zeros((4, 2), dtype = np.float64)
+		self.rotation_omega = np.zeros((3, 1), dtype = np.float64)
+		self.translate = np.zeros((3, 1), dtype = np.float64)
+		self.buffer_allocations += 1
+
+		self.gray_image = None
+		self.canny_image = None
+		self.bottom_row = None
+		self.almost_bottom_row = None
+
+	def _ensure_buffers(self, cv_image):
+		'''
+		Makes sure the image buffers are sized for the resolution of the given image,
+		allocating them only if the resolution has changed.
+		'''
+		height, width = cv_image.shape[:2]
+		self.set_resolution(height, width)
+
+	def set_resolution(self, height, width):
+		'''
+		Sizes the image buffers and the horizontal image rows for the given resolution,
+		allocating them only if the resolution has changed. This is done automatically
+		by detect_lanes but must be called before estimate_pose if the lanes were found
+		some other way.
+		'''
+		shape = (height, width)
+		if shape == self.shape:
+			return
+
+		self.shape = shape
+		self.gray_image = np.zeros((height, width), dtype = np.uint8)
+		self.canny_image = np.zeros((height, width), dtype = np.uint8)
+
+		# the horizontal image rows the lanes are intersected with are constant for a
+		# given resolution
+		self.bottom_row = height
+		self.almost_bottom_row = height-ALMOST_BOTTOM_OFFSET
+
+		self.buffer_allocations += 1
+
+	def detect_lanes(self, cv_image):
+		'''
+		Detects lanes in the specified image. The return is the same 4-tuple as
+		lane_detection.detect_lanes: a found flag, the left and right lane Line objects,
+		and the vanishing point as a column vector.
+		'''
+		self._ensure_buffers(cv_image)
+
+		# apply the canny edge detector into the reusable edge buffer
+		canny_input = cv_image
+		if self.grayscale and len(cv_image.shape) == 3:
+			cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY, self.gray_image)
+			canny_input = self.gray_image
+		cv2.Canny(canny_input, self.low_threshold, self.low_threshold*self.ratio, self.canny_image)
+
+		return self.detect_lanes_in_edges(self.canny_image)
+
+	def detect_lanes_in_edges(self, canny_image):
+		'''
+		Performs the part of detect_lanes that follows the Canny edge detector on an
+		already computed Canny image, such as one from an edge map cache. The return is
+		the same as detect_lanes.
+		'''
+		self._ensure_buffers(canny_image)
+
+		# find the lane points into the reusable point buffers
+		left_count = find_lane_points_into(canny_image, self.left_search_strips, 'left', self.left_lane_points)
+		right_count = find_lane_points_into(canny_image, self.right_search_strips, 'right', self.right_lane_points)
+
+		# RANSAC needs at least two points to define a model, so too few strip
+		# hits on either side simply means the lanes were not found
+		if left_count < 2 or right_count < 2:
+			return False, None, None, None
+
+		# fit line models to the intersections found
+		left_lane_line = self.line_fitter.fit(self.left_lane_points, left_count)
+		right_lane_line = self.line_fitter.fit(self.right_lane_points, right_count)
+
+		# if either of the lane lines cannot be found, return failure
+		if left_lane_line == None or right_lane_line == None:
+			return False, left_lane_line, right_lane_line, None
+
+		# find the vanishing point
+		vanishing_point = Line.intersection(left_lane_line, right_lane_line)
+
+		return True, left_lane_line, right_lane_line, vanishing_point
+
+	def estimate_pose(self, left_lane_line, right_lane_line, intrinsic_matrix, distortion_coefficients):
+		'''
+		Estimates the camera pose relative to the lane from the left and right lane lines
+		using cv2.solvePnP. The image points used (bottom left, bottom right, almost bottom
+		left, almost bottom right) are written in place into self.image_points. Returns a
+		3-tuple containing the solvePnP success flag, the rotation vector, and the
+		translate vector; the latter two are the processor's own buffers.
+		'''
+		self.image_points[0, 0] = row_intersection(left_lane_line, self.bottom_row)
+		self.image_points[1, 0] = row_intersection(right_lane_line, self.bottom_row)
+		self.image_points[2, 0] = row_intersection(left_lane_line, self.almost_bottom_row)
+		self.image_points[3, 0] = row_intersection(right_lane_line, self.almost_bottom_row)
+		self.image_points[0:2, 1] = self.bottom_row
+		self.image_points[2:4, 1] = self.almost_bottom_row
+
+		solve_pnp_results = cv2.solvePnP(
+			LANE_OBJECT_POINTS,
+			self.image_points,
+			intrinsic_matrix,
+			distortion_coefficients,
+			self.rotation_omega,
+			self.translate,
+		)
+		pnp_success = solve_pnp_results[0]
+
+		return pnp_success, self.rotation_omega, self.translate
+
+	def horizontal_drift(self):
+		'''
+		Returns the horizontal drift from the last pose estimate.
+		'''
+		return -self.translate[0][0]
+
+def measure_allocations(function, *arguments):
+	'''
+	Calls function with the given arguments and measures the memory it allocates using
+	tracemalloc (Python 3.9 or newer). Returns a dictionary containing peak_bytes, the
+	largest amount of memory allocated during the call above what was allocated before
+	it, and retained_bytes and retained_blocks, the memory and number of blocks still
+	allocated after it returns. For a warmed-up FrameProcessor.detect_lanes the retained
+	numbers should be close to zero and peak_bytes a few KB.
+	'''
+	if tracemalloc == None or not hasattr(tracemalloc, 'reset_peak'):
+		raise RuntimeError('measure_allocations requires tracemalloc from Python 3.9 or newer!')
+
+	was_tracing = tracemalloc.is_tracing()
+	if not was_tracing:
+		tracemalloc.start()
+	try:
+		blocks_before = sys.getallocatedblocks()
+		bytes_before, peak = tracemalloc.get_traced_memory()
+		tracemalloc.reset_peak()
+
+		function(*arguments)
+
+		bytes_after, peak = tracemalloc.get_traced_memory()
+		blocks_after = sys.getallocatedblocks()
+	finally:
+		if not was_tracing:
+			tracemalloc.stop()
+
+	return {
+		'peak_bytes': peak-bytes_before,
+		'retained_bytes': bytes_after-bytes_before,
+		'retained_blocks': blocks_after-blocks_before,
+	}
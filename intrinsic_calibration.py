@@ -172,7 +172,7 @@ def hw4_calibration(show_images = True):
 	# create a subset of the images that we'll actually use. this subset is basically
 	# num_of_images_in_subset images divided evenly in the calibration image sequence
 	num_of_images_in_subset = 36
-	calibration_image_paths_subset = [calibration_image_paths[x] for x in range(0, len(calibration_image_paths), len(calibration_image_paths)/num_of_images_in_subset)]
+	calibration_image_paths_subset = [calibration_image_paths[x] for x in range(0, len(calibration_image_paths), len(calibration_image_paths)//num_of_images_in_subset)]
 
 	image_size = (480, 640) # pixels
 	cell_shape = (9, 9) # cell shape
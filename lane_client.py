@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+'''
+This script is meant to be used standalone, but its functions can also be imported. It is
+a thin client for lane_daemon.py that replaces running lane_detection.py once per image.
+It does not import OpenCV or NumPy, so it starts quickly; the daemon keeps the search
+strips, calibration, and buffers warm between requests.
+
+Standalone behavior is to read a line from stdin and treat it as the file name for an
+image (read from stdin for the same reason as lane_detection.py: the test footage has a
+space in the file name). The image is sent to the daemon and the lane lines, vanishing
+point, and horizontal drift are printed as a line of JSON.
+
+EXAMPLE
+
+./cv python ./lane_daemon.py &
+echo -n "LDWS_test/LDWS_test_data 001.bmp" | python ./lane_client.py
+
+LICENSE
+
+Copyright (c) 2012 Viet Nguyen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+'''
+
+import json
+import os
+import socket
+import sys
+
+# the Unix socket the daemon listens on unless LANE_DAEMON_SOCKET says otherwise
+DEFAULT_SOCKET_PATH = os.environ.get('LANE_DAEMON_SOCKET', '/tmp/lane_daemon.sock')
+
+def send_request(header, data = b'', socket_path = DEFAULT_SOCKET_PATH):
+	'''
+	Sends a single request to the daemon and returns the decoded response dictionary.
+	The header is a dictionary sent as a line of JSON; data is sent right after it and
+	its length must be given in the header under 'length'.
+	'''
+	client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		client.connect(socket_path)
+		client.sendall((json.dumps(header)+'\n').encode('utf-8'))
+		if data:
+			client.sendall(data)
+		response = client.makefile('rb').readline()
+	finally:
+		client.close()
+
+	if not response:
+		raise IOError('Lane daemon at "{0}" closed the connection!'.format(socket_path))
+	return json.loads(response.decode('utf-8'))
+
+def detect_lanes_in_file(image_path, socket_path = DEFAULT_SOCKET_PATH):
+	'''
+	Asks the daemon to detect the lanes in the image at image_path. The path is made
+	absolute since the daemon may run in a different directory. See lane_daemon.py for
+	the response format.
+	'''
+	header = {'path': os.path.abspath(image_path)}
+	return send_request(header, socket_path = socket_path)
+
+def detect_lanes_in_buffer(data, shape = None, socket_path = DEFAULT_SOCKET_PATH):
+	'''
+	Asks the daemon to detect the lanes in an in-memory image. If shape is None, data
+	holds an encoded image file (e.g. BMP or PNG). Otherwise data holds raw 8-bit pixels
+	and shape is the (height, width, channels) of the image.
+	'''
+	header = {'length': len(data)}
+	if shape != None:
+		header['shape'] = list(shape)
+	return send_request(header, data, socket_path)
+
+if __name__ == '__main__':
+	image_path = sys.stdin.readline().rstrip('\n')
+
+	response = detect_lanes_in_file(image_path)
+
+	print(json.dumps(response))
+
+	if 'error' in response:
+		sys.exit(1)
@@ -0,0 +1,212 @@
+#!/usr/bin/python
+
+'''
+This script is meant to be run standalone. It is a persistent local daemon that answers
+lane detection requests over a Unix socket, so that tooling which processes one image at
+a time does not pay for importing OpenCV and NumPy, building the search strips, and
+rerunning the calibration on every image. Those are done once at startup and the frame
+processor buffers stay warm between requests. Use lane_client.py to talk to it.
+
+PROTOCOL
+
+A request is a line of JSON optionally followed by raw bytes. The JSON is either
+{"path": ...} naming an image file, or {"length": n} followed by n bytes of an encoded
+image file, or {"length": n, "shape": [height, width, channels]} followed by n bytes of
+raw 8-bit pixels. Several requests may be sent over one connection, and a connection may
+stay open between requests; every connection is served by its own thread.
+
+The response is a line of JSON. On success it contains "lanes_found" and, if the lanes
+were found, "left_lane" and "right_lane" (each as [[x, y], [a, b]], the origin and unit
+direction), "vanishing_point" as [x, y], and "horizontal_drift" (null if the daemon runs
+without calibration). A frame in which either lane has fewer than two strip hits, such
+as a frame with no lane edges at all, is a success with "lanes_found" false. "error" is
+only returned for requests that cannot be read or decoded as an image, or for an
+unexpected failure.
+
+EXAMPLE
+
+./cv python ./lane_daemon.py
+./cv python ./lane_daemon.py --no-pose
+
+LICENSE
+
+Copyright (c) 2012 Viet Nguyen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+'''
+
+import json
+import os
+import sys
+import threading
+
+try:
+	import socketserver
+except ImportError:
+	import SocketServer as socketserver
+
+import cv2
+import numpy as np
+
+from helper import colvec2tuple, tuple2floattuple
+import intrinsic_calibration
+import lane_detection
+from frame_processor import FrameProcessor
+from lane_client import DEFAULT_SOCKET_PATH
+
+def line2list(line):
+	'''
+	Converts a Line into a JSON friendly [[x, y], [a, b]] list of its origin and unit
+	direction.
+	'''
+	return [list(tuple2floattuple(colvec2tuple(line.origin))), list(tuple2floattuple(colvec2tuple(line.unit_dir)))]
+
+class LaneDaemon():
+	'''
+	Holds the warm state of the daemon (the search strips, the calibration, and the
+	frame processor) and answers decoded requests. Requests may come from several
+	threads; the frame processor is only used by one of them at a time.
+	'''
+
+	def __init__(self, with_pose = True):
+		'''
+		Builds the homework 4 search strips and frame processor and, if with_pose is
+		True, runs the homework 4 calibration so that the horizontal drift can be
+		reported.
+		'''
+		left_search_strips, right_search_strips = lane_detection.define_hw4_search_strips()
+		self.processor = FrameProcessor(left_search_strips, right_search_strips)
+		self.processor_lock = threading.Lock()
+
+		self.intrinsic_matrix = None
+		self.distortion_coefficients = None
+		if with_pose:
+			self.intrinsic_matrix, self.distortion_coefficients = intrinsic_calibration.hw4_calibration(False)
+
+	def load_image(self, header, data):
+		'''
+		Returns the image a request refers to, or None if it cannot be read.
+		'''
+		if 'path' in header:
+			return cv2.imread(header['path'])
+
+		buffer = np.frombuffer(data, dtype = np.uint8)
+		if 'shape' in header:
+			shape = tuple(header['shape'])
+			if buffer.size != int(np.prod(shape)):
+				return None
+			return buffer.reshape(shape)
+
+		return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+	def handle(self, header, data):
+		'''
+		Answers a single request and returns the response dictionary. The image is
+		loaded outside of the processor lock so that reading and decoding can overlap
+		with another request's processing.
+		'''
+		cv_image = self.load_image(header, data)
+		if cv_image is None:
+			return {'error': 'Could not load the request as an image!'}
+
+		with self.processor_lock:
+			return self.process(cv_image)
+
+	def process(self, cv_image):
+		'''
+		Detects the lanes and estimates the pose of a loaded image and returns the
+		response dictionary. The caller must hold the processor lock.
+		'''
+		# the processor reports too few strip hits as lanes not found rather than letting
+		# RANSAC fail, so a frame without lane edges is not an error
+		lanes_found, left_lane_line, right_lane_line, vanishing_point = \
+			self.processor.detect_lanes(cv_image)
+
+		if not lanes_found:
+			return {'lanes_found': False}
+
+		horizontal_drift = None
+		if self.intrinsic_matrix is not None:
+			pnp_success, rotation_omega, translate = self.processor.estimate_pose(
+				left_lane_line,
+				right_lane_line,
+				self.intrinsic_matrix,
+				self.distortion_coefficients,
+			)
+			if pnp_success:
+				horizontal_drift = float(self.processor.horizontal_drift())
+
+		return {
+			'lanes_found': True,
+			'left_lane': line2list(left_lane_line),
+			'right_lane': line2list(right_lane_line),
+			'vanishing_point': list(tuple2floattuple(colvec2tuple(vanishing_point))),
+			'horizontal_drift': horizontal_drift,
+		}
+
+class LaneRequestHandler(socketserver.StreamRequestHandler):
+	'''
+	Reads requests from a connection until it is closed and writes one response line
+	per request.
+	'''
+
+	def handle(self):
+		'''
+		Answers requests until the client closes the connection. Errors are reported to
+		the client rather than stopping the daemon.
+		'''
+		while True:
+			line = self.rfile.readline()
+			if not line:
+				break
+
+			try:
+				header = json.loads(line.decode('utf-8'))
+				data = self.rfile.read(header.get('length', 0)) if 'path' not in header else b''
+				response = self.server.lane_daemon.handle(header, data)
+			except Exception as error:
+				response = {'error': '{0}: {1}'.format(type(error).__name__, error)}
+
+			self.wfile.write((json.dumps(response)+'\n').encode('utf-8'))
+			self.wfile.flush()
+
+def serve(socket_path = DEFAULT_SOCKET_PATH, with_pose = True):
+	'''
+	Starts the daemon on the given Unix socket and serves requests until interrupted.
+	Every connection gets its own thread, so an idle client that keeps its connection
+	open does not hold up the others; the frame processor itself is used by one request
+	at a time.
+	'''
+	daemon = LaneDaemon(with_pose)
+
+	if os.path.exists(socket_path):
+		os.remove(socket_path)
+
+	server = socketserver.ThreadingUnixStreamServer(socket_path, LaneRequestHandler)
+	server.daemon_threads = True
+	server.lane_daemon = daemon
+	print('lane daemon listening on {0}'.format(socket_path))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		os.remove(socket_path)
+
+if __name__ == '__main__':
+	serve(with_pose = '--no-pose' not in sys.argv[1:])
@@ -11,6 +11,10 @@ EXAMPLE
 
 echo -n "LDWS_test/LDWS_test_data 001.bmp" | ./cv ipython --pdb ./lane_detection.py
 
+Tooling that needs the lane lines of many images one at a time should use lane_client.py
+against a running lane_daemon.py instead, which avoids the startup cost of this script on
+every image.
+
 LICENSE
 
 Copyright (c) 2012 Viet Nguyen
@@ -120,7 +124,20 @@ def find_lane_points(canny_image, search_strips, lane):
 	is a list of LaneSearchStrip objects. The third argument is a string, either
 	'left' or 'right' denoting what lane the search strips are looking for. This is
 	important because it determines which direction the search goes, left (for left)
-	and right (for right).
+	and right (for right). The return is a list of 2-tuples; the search itself is done
+	by find_lane_points_into.
+	'''
+	lane_points = np.zeros((len(search_strips), 2), dtype = np.int32)
+	count = find_lane_points_into(canny_image, search_strips, lane, lane_points)
+	return [(int(x), int(y)) for x, y in lane_points[:count]]
+
+def find_lane_points_into(canny_image, search_strips, lane, lane_points):
+	'''
+	Performs the search of find_lane_points but writes the found points into the
+	preallocated lane_points argument instead of building a new list. The lane_points
+	argument must be a NumPy array of shape (N, 2) where N is at least the number of
+	search strips. Returns the number of points found; only the first that many rows of
+	lane_points are valid.
 	'''
 	# make sure the lane is either left or right
 	assert(lane == 'left' or lane == 'right')
@@ -134,9 +151,8 @@ def find_lane_points(canny_image, search_strips, lane):
 		direction = 1
 		start_point_name = 'left_point'
 		end_point_name = 'right_point'
-	
-	# initialize an empty set of points
-	lane_points = []
+
+	count = 0
 
 	# search each search strip
 	for search_strip in search_strips:
@@ -147,22 +163,23 @@ def find_lane_points(canny_image, search_strips, lane):
 		end_point = getattr(search_strip, end_point_name)
 
 		x, y = start_point
-		
+
 		# walk, pixel-by-pixel, in the correct search direction looking at the canny
 		# image until we see an edge (white)
 		while( x * direction <= end_point[0] * direction ):
-			intensity_at_point = canny_image[y][x]
 
 			#if we've found an edge, save this point and break
-			if intensity_at_point == 255:
-				lane_points.append((x, y))
+			if canny_image[y, x] == 255:
+				lane_points[count, 0] = x
+				lane_points[count, 1] = y
+				count += 1
 				break
 
 			x += direction
 
-	return lane_points
+	return count
 
-def detect_lanes(cv_image, left_search_strips, right_search_strips):
+def detect_lanes(cv_image, left_search_strips, right_search_strips, low_threshold = 100, ratio = 3, num_of_iterations = 100, tolerance = 4.0):
 	'''
 	Detects lanes in the specified image based on the specified search strips. The first
 	argument is a OpenCV image. The second and third arguments are the left and right
@@ -173,22 +190,37 @@ def detect_lanes(cv_image, left_search_strips, right_search_strips):
 	the left and right lanes respectively. The last item in the return tuple is a
 	column vector of NumPy matrix type of length 2 that represents the location of the
 	vanishing point.
-	'''
-	# turn canny detector knobs
-	low_threshold = 100
-	ratio = 3
 
+	The optional keyword arguments low_threshold and ratio are the Canny detector knobs
+	and num_of_iterations and tolerance are passed on to ransac_line2d.
+	'''
 	# apply the canny edge detector
 	canny_image = cv2.Canny(cv_image, low_threshold, low_threshold*ratio)
 
+	return detect_lanes_in_edges(canny_image, left_search_strips, right_search_strips, num_of_iterations, tolerance)
+
+def detect_lanes_in_edges(canny_image, left_search_strips, right_search_strips, num_of_iterations = 100, tolerance = 4.0):
+	'''
+	Performs the part of detect_lanes that follows the Canny edge detector. The first
+	argument is the Canny image; the rest of the arguments and the return are the same
+	as detect_lanes.
+	'''
 	# find the intersections between the search strips and the edges from the canny
 	# detector
 	left_lane_points = find_lane_points(canny_image, left_search_strips, 'left')
 	right_lane_points = find_lane_points(canny_image, right_search_strips, 'right')
 
+	return fit_lanes(left_lane_points, right_lane_points, num_of_iterations, tolerance)
+
+def fit_lanes(left_lane_points, right_lane_points, num_of_iterations = 100, tolerance = 4.0):
+	'''
+	Performs the part of detect_lanes that follows the lane point search: fits lines to
+	the left and right lane points (lists of 2-tuples) with ransac_line2d and intersects
+	them. The return is the same as detect_lanes.
+	'''
 	# fit line models to the intersections found
-	left_lane_line = ransac_line2d(left_lane_points)
-	right_lane_line = ransac_line2d(right_lane_points)
+	left_lane_line = ransac_line2d(left_lane_points, num_of_iterations, tolerance)
+	right_lane_line = ransac_line2d(right_lane_points, num_of_iterations, tolerance)
 
 	# if either of the lane lines cannot be found, return failure
 	if left_lane_line == None or right_lane_line == None:
@@ -199,17 +231,13 @@ def detect_lanes(cv_image, left_search_strips, right_search_strips):
 
 	return True, left_lane_line, right_lane_line, vanishing_point
 
-def define_hw4_search_strips():
+def define_hw4_search_strips(vertical_interval = (218, 368), vertical_step = 10, width_interval = (36, 120), left_center_interval = (205, -15), right_center_interval = (280, 440), clip_region = (0, 0, 640, 480)):
 	'''
 	Returns a 2-tuple containing the list of left lane search strips and the lits of
-	right lane search strips specific to homework 4.
+	right lane search strips specific to homework 4. The strip geometry defaults to the
+	homework 4 values but can be overridden with the keyword arguments, which have the
+	same meaning as in create_search_strip_set.
 	'''
-	vertical_interval = (218, 368)
-	vertical_step = 10
-	width_interval = (36, 120)
-	left_center_interval = (205, -15)
-	right_center_interval = (280, 440)
-	clip_region = (0, 0, 640, 480)
 
 	left_search_strips = create_search_strip_set(
 		vertical_interval, vertical_step,
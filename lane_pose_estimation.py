@@ -24,16 +24,20 @@ import math
 import sys
 
 import cv2
-import numpy as np
 
-from helper import colvec2tuple, tuple2colvec, tuple2inttuple
+from helper import colvec2tuple, tuple2inttuple
 import intrinsic_calibration
 import lane_detection
-from line import Line
+from frame_cache import FrameResultCache, strip_band, strip_band_fingerprint
+from frame_processor import FrameProcessor
 
-def hw4_lane_pose_estimation():
+def hw4_lane_pose_estimation(use_cache = True):
 	'''
 	TODO DOCUMENTATION
+
+	If use_cache is True (the default), frames whose strip band fingerprint is within
+	the cache threshold of a recent frame reuse that frame's detection and pose results.
+	The cache hit and miss counts are printed at the end of the sequence.
 	'''
 
 	image_paths = ['LDWS_test/LDWS_test_data {0:03}.bmp'.format(x) for x in range(1, 609)]
@@ -42,77 +46,91 @@ def hw4_lane_pose_estimation():
 
 	left_search_strips, right_search_strips = lane_detection.define_hw4_search_strips()
 
+	# the frame processor keeps the edge, point and pose buffers alive between frames
+	processor = FrameProcessor(left_search_strips, right_search_strips)
+
+	# near-duplicate frames reuse the results of a recent frame
+	cache = FrameResultCache()
+	band = strip_band([left_search_strips, right_search_strips])
+
 	cv2.namedWindow('display')
 
 	for image_path in image_paths:
 		cv_image = cv2.imread(image_path)
 
-		lanes_found, left_lane_line, right_lane_line, vanishing_point = \
-			lane_detection.detect_lanes(
-				cv_image,
-				left_search_strips,
-				right_search_strips,
-			)
+		frame_result = None
+		if use_cache:
+			fingerprint = strip_band_fingerprint(cv_image, band)
+			frame_result = cache.lookup(fingerprint)
+
+		if frame_result == None:
+			frame_result = process_frame(processor, cv_image, intrinsic_matrix, distortion_coefficients)
+			if use_cache:
+				cache.store(fingerprint, frame_result)
+
+		lanes_found, vanishing_point_pixels, lane_pixels, horizontal_drift = frame_result
 
 		display_image = cv_image
 
 		if lanes_found:
-			vanishing_point_pixels = tuple2inttuple(colvec2tuple(vanishing_point))
-			cv2.circle(display_image, vanishing_point_pixels, 10, (255, 255, 255))
-
-			bottom_image_line = Line(np.matrix([[0],[480]]), np.matrix([[1],[0]]))
-			bottom_left = Line.intersection(left_lane_line, bottom_image_line)
-			bottom_right = Line.intersection(right_lane_line, bottom_image_line)
-			bottom_left_pixels = tuple2inttuple(colvec2tuple(bottom_left))
-			bottom_right_pixels = tuple2inttuple(colvec2tuple(bottom_right))
-			cv2.circle(display_image, bottom_left_pixels, 10, (0, 0, 255))
-			cv2.circle(display_image, bottom_right_pixels, 10, (255, 0, 0))
-
-			almost_bottom_image_line = Line(np.matrix([[0],[480-150]]), np.matrix([[1],[0]]))
-			almost_bottom_left = Line.intersection(left_lane_line, almost_bottom_image_line)
-			almost_bottom_right = Line.intersection(right_lane_line, almost_bottom_image_line)
-			almost_bottom_left_pixels = tuple2inttuple(colvec2tuple(almost_bottom_left))
-			almost_bottom_right_pixels = tuple2inttuple(colvec2tuple(almost_bottom_right))
-			cv2.circle(display_image, almost_bottom_left_pixels, 10, (0, 0, 255))
-			cv2.circle(display_image, almost_bottom_right_pixels, 10, (255, 0, 0))
-
-			cv2.line(display_image, vanishing_point_pixels, bottom_left_pixels, (255, 0, 255), 1, cv2.CV_AA)
-			cv2.line(display_image, vanishing_point_pixels, bottom_right_pixels, (255, 0, 255), 1, cv2.CV_AA)
-
-			object_points = np.array([
-				[-1.6, 0, 0],
-				[1.6, 0, 0],
-				[-1.6, 4.0, 0],
-				[1.6, 4.0, 0],
-			])
-
-			image_points = np.array([
-				bottom_left.T.A[0],
-				bottom_right.T.A[0],
-				almost_bottom_left.T.A[0],
-				almost_bottom_right.T.A[0],
-			])
-			
-			solve_pnp_results = cv2.solvePnP(
-				object_points,
-				image_points,
-				intrinsic_matrix,
-				distortion_coefficients,
-			)
-
-			pnp_success, rotation_omega, translate = solve_pnp_results
-			horizontal_drift = -translate[0][0]
 			print(horizontal_drift)
-			
-			cv2.line(display_image, (320-80, 10), (320+80, 10), (0, 0, 0), 1, cv2.CV_AA)
-			cv2.line(display_image, (320-80, 10), (320-80, 50), (0, 0, 0), 1, cv2.CV_AA)
-			cv2.line(display_image, (320+80, 10), (320+80, 50), (0, 0, 0), 1, cv2.CV_AA)
-			cv2.line(display_image, (320-80, 50), (320+80, 50), (0, 0, 0), 1, cv2.CV_AA)
-			cv2.line(display_image, (320+int(40*horizontal_drift/0.4), 30), (320+int(40*horizontal_drift/0.4), 50), (0, 0, 0), 1, cv2.CV_AA)
+			draw_lane_pose(display_image, vanishing_point_pixels, *lane_pixels, horizontal_drift = horizontal_drift)
 
 		cv2.imshow('display', display_image)
 		cv2.waitKey(1)
 
+	if use_cache:
+		print('cache hits: {0}, misses: {1}'.format(cache.hits, cache.misses))
+
+def process_frame(processor, cv_image, intrinsic_matrix, distortion_coefficients):
+	'''
+	Runs lane detection and pose estimation on a single frame with the given
+	FrameProcessor. Returns a 4-tuple containing the lanes found flag, the vanishing
+	point as an integer 2-tuple, a 4-tuple of the integer 2-tuple lane base points
+	(bottom left, bottom right, almost bottom left, almost bottom right), and the
+	horizontal drift. If the lanes are not found the last three items are None. The
+	result holds no references to the processor's buffers so it is safe to cache.
+	'''
+	lanes_found, left_lane_line, right_lane_line, vanishing_point = \
+		processor.detect_lanes(cv_image)
+
+	if not lanes_found:
+		return False, None, None, None
+
+	processor.estimate_pose(
+		left_lane_line,
+		right_lane_line,
+		intrinsic_matrix,
+		distortion_coefficients,
+	)
+	horizontal_drift = processor.horizontal_drift()
+
+	vanishing_point_pixels = tuple2inttuple(colvec2tuple(vanishing_point))
+	lane_pixels = tuple([tuple2inttuple(point) for point in processor.image_points])
+
+	return True, vanishing_point_pixels, lane_pixels, horizontal_drift
+
+def draw_lane_pose(display_image, vanishing_point_pixels, bottom_left_pixels, bottom_right_pixels, almost_bottom_left_pixels, almost_bottom_right_pixels, horizontal_drift):
+	'''
+	Draws the vanishing point, the lane base points, the lane lines, and the horizontal
+	drift gauge onto display_image in place. All points are passed as integer 2-tuples.
+	'''
+	cv2.circle(display_image, vanishing_point_pixels, 10, (255, 255, 255))
+
+	cv2.circle(display_image, bottom_left_pixels, 10, (0, 0, 255))
+	cv2.circle(display_image, bottom_right_pixels, 10, (255, 0, 0))
+	cv2.circle(display_image, almost_bottom_left_pixels, 10, (0, 0, 255))
+	cv2.circle(display_image, almost_bottom_right_pixels, 10, (255, 0, 0))
+
+	cv2.line(display_image, vanishing_point_pixels, bottom_left_pixels, (255, 0, 255), 1, cv2.CV_AA)
+	cv2.line(display_image, vanishing_point_pixels, bottom_right_pixels, (255, 0, 255), 1, cv2.CV_AA)
+
+	cv2.line(display_image, (320-80, 10), (320+80, 10), (0, 0, 0), 1, cv2.CV_AA)
+	cv2.line(display_image, (320-80, 10), (320-80, 50), (0, 0, 0), 1, cv2.CV_AA)
+	cv2.line(display_image, (320+80, 10), (320+80, 50), (0, 0, 0), 1, cv2.CV_AA)
+	cv2.line(display_image, (320-80, 50), (320+80, 50), (0, 0, 0), 1, cv2.CV_AA)
+	cv2.line(display_image, (320+int(40*horizontal_drift/0.4), 30), (320+int(40*horizontal_drift/0.4), 50), (0, 0, 0), 1, cv2.CV_AA)
+
 if __name__ == '__main__':
 	hw4_lane_pose_estimation()
 	
@@ -0,0 +1,485 @@
+#!/usr/bin/python3
+
+'''
+This script is meant to be imported for its functionality. However, a standalone
+behavior does exist. It provides a long-running asyncio service that runs lane detection
+and pose estimation on several concurrent frame streams. Each stream belongs to a camera
+whose intrinsic calibration and search strip sets are looked up in a CameraRegistry that
+loads them only once. Frames are read from a source (image files, a paced replay of a
+recorded sequence, or a socket), pass through a bounded per-stream queue with a drop
+policy, and are processed in a bounded process pool. Per-stream pose results are
+published to subscribers.
+
+Lane detection is mostly pure Python and holds the GIL, so frames are processed in
+worker processes rather than threads. Every worker process keeps its own frame
+processor per camera. The registry, the sources, and the queues stay in the event loop
+process, and file reads and calibration loads run in a small thread pool there.
+
+Each stream has at most one frame in the process pool at a time, so a slow stream cannot
+take more than its share of workers, and a stream whose queue fills up only drops its
+own frames.
+
+Standalone behavior is to replay the homework 4 test sequence as a stream and print the
+horizontal drift of every frame.
+
+Unlike the rest of the scripts this one requires Python 3 for asyncio.
+
+EXAMPLE
+
+./cv python3 ./lane_service.py
+
+LICENSE
+
+Copyright (c) 2012 Viet Nguyen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+'''
+
+import asyncio
+import concurrent.futures
+import struct
+
+import cv2
+import numpy as np
+
+import intrinsic_calibration
+import lane_detection
+from frame_processor import FrameProcessor
+from lane_pose_estimation import process_frame
+
+# the drop policies a StreamQueue can use when it is full
+DROP_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+# marks the end of a stream in its queue
+END_OF_STREAM = object()
+
+# the frame processors of a worker process, keyed by camera id and search strip geometry
+worker_processors = {}
+
+def init_worker():
+	'''
+	Process pool initializer. Starts every worker process without frame processors.
+	'''
+	worker_processors.clear()
+
+def process_worker_frame(camera_id, profile, cv_image):
+	'''
+	Runs lane_pose_estimation.process_frame on a frame in a worker process, using the
+	worker's own FrameProcessor for the camera. The processor is built the first time
+	the worker sees the camera, and again if the camera's search strips changed.
+	'''
+	strip_key = tuple([(strip.left_point, strip.width) for strip in profile.left_search_strips+profile.right_search_strips])
+	key = (camera_id, strip_key)
+	if key not in worker_processors:
+		for old_key in [old_key for old_key in worker_processors if old_key[0] == camera_id]:
+			del worker_processors[old_key]
+		worker_processors[key] = FrameProcessor(profile.left_search_strips, profile.right_search_strips)
+
+	return process_frame(
+		worker_processors[key],
+		cv_image,
+		profile.intrinsic_matrix,
+		profile.distortion_coefficients,
+	)
+
+class CameraProfile():
+	'''
+	Everything needed to process frames from one camera: the intrinsic camera matrix,
+	the distortion coefficients, and the left and right lane search strip sets.
+	'''
+
+	def __init__(self, intrinsic_matrix, distortion_coefficients, left_search_strips, right_search_strips):
+		'''
+		Creates a camera profile from its calibration and search strip sets.
+		'''
+		self.intrinsic_matrix = intrinsic_matrix
+		self.distortion_coefficients = distortion_coefficients
+		self.left_search_strips = left_search_strips
+		self.right_search_strips = right_search_strips
+
+class CameraRegistry():
+	'''
+	Maps camera ids to CameraProfile objects. Profiles are loaded lazily the first time
+	they are requested and only once, even if several streams request the same camera
+	concurrently.
+	'''
+
+	def __init__(self):
+		'''
+		Creates an empty registry.
+		'''
+		self.loaders = {}
+		self.profiles = {}
+
+	def register(self, camera_id, load_calibration, load_search_strips):
+		'''
+		Registers a camera. The load_calibration argument is a function taking no
+		arguments that returns a 2-tuple containing the intrinsic camera matrix and the
+		distortion coefficients (like intrinsic_calibration.hw4_calibration). The
+		load_search_strips argument is a function taking no arguments that returns a
+		2-tuple containing the left and right search strip sets (like
+		lane_detection.define_hw4_search_strips).
+		'''
+		self.loaders[camera_id] = (load_calibration, load_search_strips)
+		self.profiles.pop(camera_id, None)
+
+	def _load(self, camera_id):
+		'''
+		Loads the profile of a camera by calling its loaders.
+		'''
+		load_calibration, load_search_strips = self.loaders[camera_id]
+		intrinsic_matrix, distortion_coefficients = load_calibration()
+		left_search_strips, right_search_strips = load_search_strips()
+		return CameraProfile(intrinsic_matrix, distortion_coefficients, left_search_strips, right_search_strips)
+
+	async def get(self, camera_id, executor = None):
+		'''
+		Returns the CameraProfile of the given camera, loading it in the given executor
+		if it has not been loaded yet. Raises KeyError if the camera is not registered.
+		'''
+		if camera_id not in self.loaders:
+			raise KeyError('Camera "{0}" is not registered!'.format(camera_id))
+
+		if camera_id not in self.profiles:
+			loop = asyncio.get_event_loop()
+			self.profiles[camera_id] = loop.run_in_executor(executor, self._load, camera_id)
+
+		profile_future = self.profiles[camera_id]
+		try:
+			return await profile_future
+		except Exception:
+			# forget a failed load so that the next request retries it
+			if self.profiles.get(camera_id) is profile_future:
+				del self.profiles[camera_id]
+			raise
+
+class StreamQueue():
+	'''
+	A bounded frame queue with a drop policy that decides what happens when a frame
+	arrives and the queue is full: 'drop_oldest' discards the oldest queued frame,
+	'drop_newest' discards the arriving frame, and 'block' waits for room. The number of
+	discarded frames is kept in the dropped attribute.
+	'''
+
+	def __init__(self, maxsize = 4, drop_policy = 'drop_oldest'):
+		'''
+		Creates an empty queue holding at most maxsize frames.
+		'''
+		if drop_policy not in DROP_POLICIES:
+			raise ValueError('Unknown drop policy "{0}"!'.format(drop_policy))
+		self.queue = asyncio.Queue(maxsize)
+		self.drop_policy = drop_policy
+		self.dropped = 0
+
+	async def put(self, item):
+		'''
+		Adds an item to the queue according to the drop policy.
+		'''
+		if self.drop_policy == 'block':
+			await self.queue.put(item)
+			return
+
+		if self.queue.full():
+			self.dropped += 1
+			if self.drop_policy == 'drop_newest':
+				return
+			self.queue.get_nowait()
+
+		self.queue.put_nowait(item)
+
+	async def close(self):
+		'''
+		Marks the end of the stream. The end marker is never dropped. Under the 'block'
+		policy it waits for room like any frame, so no frame is lost; under the other
+		policies the oldest frame makes room for it if the queue is full.
+		'''
+		if self.drop_policy == 'block':
+			await self.queue.put(END_OF_STREAM)
+			return
+
+		if self.queue.full():
+			self.queue.get_nowait()
+			self.dropped += 1
+		self.queue.put_nowait(END_OF_STREAM)
+
+	async def get(self):
+		'''
+		Removes and returns the next item, waiting for one if the queue is empty.
+		'''
+		return await self.queue.get()
+
+async def file_source(image_paths, executor = None):
+	'''
+	Yields (frame index, image) 2-tuples for the images in image_paths, reading them in
+	the given executor. Images that cannot be read are skipped.
+	'''
+	loop = asyncio.get_event_loop()
+	for frame_index, image_path in enumerate(image_paths):
+		cv_image = await loop.run_in_executor(executor, cv2.imread, image_path)
+		if cv_image is None:
+			continue
+		yield frame_index, cv_image
+
+async def replay_source(image_paths, frame_rate = 30.0, executor = None):
+	'''
+	Yields (frame index, image) 2-tuples for a recorded sequence like file_source, but
+	paced at frame_rate frames per second as if it were coming from a live camera.
+	'''
+	loop = asyncio.get_event_loop()
+	start_time = loop.time()
+	async for frame_index, cv_image in file_source(image_paths, executor):
+		delay = start_time+frame_index/frame_rate-loop.time()
+		if delay > 0:
+			await asyncio.sleep(delay)
+		yield frame_index, cv_image
+
+async def socket_source(reader):
+	'''
+	Yields (frame index, image) 2-tuples for frames read from an asyncio StreamReader.
+	Each frame is sent as a 4-byte big-endian length followed by that many bytes of an
+	encoded image (e.g. BMP or PNG). The stream ends when the connection is closed.
+	'''
+	frame_index = 0
+	while True:
+		try:
+			header = await reader.readexactly(4)
+			length, = struct.unpack('!I', header)
+			data = await reader.readexactly(length)
+		except asyncio.IncompleteReadError:
+			return
+
+		cv_image = cv2.imdecode(np.frombuffer(data, dtype = np.uint8), cv2.IMREAD_COLOR)
+		if cv_image is not None:
+			yield frame_index, cv_image
+		frame_index += 1
+
+class LaneService():
+	'''
+	Runs lane detection and pose estimation on several concurrent frame streams and
+	publishes the results to subscribers. Results are published as 3-tuples containing
+	the stream id, the frame index, and the result of lane_pose_estimation.process_frame.
+	'''
+
+	def __init__(self, registry, max_workers = 4, max_io_workers = 2):
+		'''
+		Creates a service that looks cameras up in the given CameraRegistry and processes
+		frames in a process pool of at most max_workers processes. Camera profiles are
+		loaded, and can be read by sources, in the io_executor thread pool of at most
+		max_io_workers threads.
+		'''
+		self.registry = registry
+		self.executor = concurrent.futures.ProcessPoolExecutor(max_workers, initializer = init_worker)
+		self.io_executor = concurrent.futures.ThreadPoolExecutor(max_io_workers)
+		self.streams = {}
+		self.subscribers = []
+
+	def add_stream(self, stream_id, camera_id, source, queue_size = 4, drop_policy = 'drop_oldest'):
+		'''
+		Starts processing a stream. The source is an asynchronous iterator of (frame
+		index, image) 2-tuples such as file_source, replay_source, or socket_source.
+		Frames wait in a StreamQueue of queue_size frames with the given drop policy.
+		Raises ValueError if a stream with the same id is still running.
+
+		Returns an asyncio future that completes with the final stream statistics (see
+		stream_stats) once the stream has been read and processed to its end. The stream
+		is forgotten by the service at that point, so its id can be reused.
+		'''
+		if stream_id in self.streams:
+			raise ValueError('Stream "{0}" already exists!'.format(stream_id))
+
+		stream_queue = StreamQueue(queue_size, drop_policy)
+		stats = {'received': 0, 'processed': 0, 'failed': 0}
+		entry = (stream_queue, stats, [])
+		task = asyncio.ensure_future(self._run_stream(stream_id, camera_id, source, entry))
+		entry[2].append(task)
+		self.streams[stream_id] = entry
+		return task
+
+	async def _run_stream(self, stream_id, camera_id, source, entry):
+		'''
+		Runs the reading and processing of a stream and removes the stream from the
+		service when both are done or either fails. Returns the final statistics.
+		'''
+		stream_queue, stats, tasks = entry
+		reader = asyncio.ensure_future(self._read_stream(source, stream_queue, stats))
+		processor = asyncio.ensure_future(self._process_stream(stream_id, camera_id, stream_queue, stats))
+		try:
+			await asyncio.gather(reader, processor)
+		finally:
+			# if one side failed or the stream was cancelled, stop the other side too
+			reader.cancel()
+			processor.cancel()
+			if self.streams.get(stream_id) is entry:
+				del self.streams[stream_id]
+		return dict(stats, dropped = stream_queue.dropped)
+
+	async def _read_stream(self, source, stream_queue, stats):
+		'''
+		Pumps frames from a source into its stream queue. A source that fails ends the
+		stream like one that is exhausted; the error is kept in the source_error
+		statistic.
+		'''
+		try:
+			async for frame in source:
+				stats['received'] += 1
+				await stream_queue.put(frame)
+		except asyncio.CancelledError:
+			raise
+		except Exception as error:
+			stats['source_error'] = '{0}: {1}'.format(type(error).__name__, error)
+		await stream_queue.close()
+
+	async def _process_stream(self, stream_id, camera_id, stream_queue, stats):
+		'''
+		Processes the frames of a stream one at a time in the process pool and publishes
+		the results. A frame that cannot be processed is published as not found and
+		counted in the failed statistic instead of ending the stream.
+		'''
+		profile = await self.registry.get(camera_id, self.io_executor)
+
+		loop = asyncio.get_event_loop()
+		while True:
+			item = await stream_queue.get()
+			if item is END_OF_STREAM:
+				break
+			frame_index, cv_image = item
+
+			try:
+				result = await loop.run_in_executor(
+					self.executor,
+					process_worker_frame,
+					camera_id,
+					profile,
+					cv_image,
+				)
+				stats['processed'] += 1
+			except Exception:
+				result = (False, None, None, None)
+				stats['failed'] += 1
+			self._publish(stream_id, frame_index, result)
+
+	def _publish(self, stream_id, frame_index, result):
+		'''
+		Hands a result to every matching subscriber. A subscriber whose queue is full
+		loses its oldest result rather than holding up the stream.
+		'''
+		for subscriber_stream_id, subscriber_queue in self.subscribers:
+			if subscriber_stream_id != None and subscriber_stream_id != stream_id:
+				continue
+			if subscriber_queue.full():
+				subscriber_queue.get_nowait()
+			subscriber_queue.put_nowait((stream_id, frame_index, result))
+
+	def subscribe(self, stream_id = None, queue_size = 64):
+		'''
+		Returns an asyncio.Queue that receives the results of the given stream, or of
+		all streams if stream_id is None.
+		'''
+		subscriber_queue = asyncio.Queue(queue_size)
+		self.subscribers.append((stream_id, subscriber_queue))
+		return subscriber_queue
+
+	def unsubscribe(self, subscriber_queue):
+		'''
+		Stops publishing results to a queue returned by subscribe.
+		'''
+		self.subscribers = [(stream_id, q) for stream_id, q in self.subscribers if q is not subscriber_queue]
+
+	def stream_stats(self, stream_id):
+		'''
+		Returns a dictionary with the number of frames received, processed, failed, and
+		dropped by a running stream. Raises KeyError if the stream is not running.
+		'''
+		stream_queue, stats, tasks = self.streams[stream_id]
+		return dict(stats, dropped = stream_queue.dropped)
+
+	async def wait_stream(self, stream_id):
+		'''
+		Waits until a running stream has been read and processed to its end and returns
+		its final statistics. Raises KeyError if the stream is not running.
+		'''
+		stream_queue, stats, tasks = self.streams[stream_id]
+		return await tasks[0]
+
+	async def serve_sockets(self, camera_id, host = '127.0.0.1', port = 5268, queue_size = 4, drop_policy = 'drop_oldest'):
+		'''
+		Accepts socket connections as streams of the given camera. A client first sends
+		its stream id terminated by a newline and then frames as read by socket_source.
+		A connection whose stream id is already running is closed right away. Returns the
+		asyncio server.
+		'''
+		async def handle_connection(reader, writer):
+			try:
+				stream_id = (await reader.readline()).decode('utf-8').strip()
+				await self.add_stream(stream_id, camera_id, socket_source(reader), queue_size, drop_policy)
+			except ValueError:
+				pass
+			finally:
+				writer.close()
+
+		return await asyncio.start_server(handle_connection, host, port)
+
+	def close(self):
+		'''
+		Cancels every stream and shuts the process pool and the thread pool down.
+		'''
+		for stream_queue, stats, tasks in list(self.streams.values()):
+			for task in tasks:
+				task.cancel()
+		self.executor.shutdown(wait = False)
+		self.io_executor.shutdown(wait = False)
+
+async def hw4_lane_service():
+	'''
+	Replays the homework 4 test sequence through the service and prints the horizontal
+	drift of every frame along with the stream statistics.
+	'''
+	image_paths = ['LDWS_test/LDWS_test_data {0:03}.bmp'.format(x) for x in range(1, 609)]
+
+	registry = CameraRegistry()
+	registry.register(
+		'hw4',
+		lambda: intrinsic_calibration.hw4_calibration(False),
+		lane_detection.define_hw4_search_strips,
+	)
+
+	service = LaneService(registry)
+	results = service.subscribe('hw4')
+	service.add_stream('hw4', 'hw4', replay_source(image_paths, 15.0, service.io_executor))
+
+	def print_result(result):
+		stream_id, frame_index, (lanes_found, vanishing_point_pixels, lane_pixels, horizontal_drift) = result
+		if lanes_found:
+			print('{0} {1:03}: {2}'.format(stream_id, frame_index, horizontal_drift))
+
+	async def print_results():
+		while True:
+			print_result(await results.get())
+
+	printer = asyncio.ensure_future(print_results())
+	stats = await service.wait_stream('hw4')
+	printer.cancel()
+
+	# print whatever was published after the printer last ran
+	while not results.empty():
+		print_result(results.get_nowait())
+
+	print(stats)
+	service.close()
+
+if __name__ == '__main__':
+	asyncio.run(hw4_lane_service())
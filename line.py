@@ -168,3 +168,141 @@ def ransac_line2d(points, num_of_iterations = 100, tolerance = 4.0):
 		iteration_count += 1
 	
 	return best_model
+
+class RansacLineFitter():
+	'''
+	Fits line models exactly like ransac_line2d but scores all of the candidate models
+	at once with NumPy array math over buffers that are allocated once and reused for
+	every fit. The candidate models are drawn with the same random.shuffle calls as
+	ransac_line2d, so for the same random state both pick the same pair of points for
+	every iteration. Only the floating point rounding of the scores differs, so when two
+	models score within rounding error of each other the fitter may pick the other one.
+
+	The votes of every point for every model are laid out flat (model major) so that
+	every array operation works on same-shaped contiguous arrays; broadcasting would
+	make NumPy allocate iteration buffers on every call.
+	'''
+
+	def __init__(self, max_num_of_points, num_of_iterations = 100, tolerance = 4.0):
+		'''
+		Creates a fitter for up to max_num_of_points points. The num_of_iterations and
+		tolerance knobs default to the same values as in ransac_line2d.
+		'''
+		self.max_num_of_points = max_num_of_points
+		self.num_of_iterations = num_of_iterations
+		self.tolerance = tolerance
+
+		# the shuffled bag of point indices and the pair drawn in every iteration
+		self.bag_of_indices = list(range(max_num_of_points))
+		self.first_indices = np.zeros(num_of_iterations, dtype = np.intp)
+		self.second_indices = np.zeros(num_of_iterations, dtype = np.intp)
+		self.vote_indices = np.zeros(num_of_iterations, dtype = np.intp)
+
+		# the point coordinates as floats
+		self.xs = np.zeros(max_num_of_points, dtype = np.float64)
+		self.ys = np.zeros(max_num_of_points, dtype = np.float64)
+
+		# the origin, unit direction, and direction norm of every model
+		self.origin_xs = np.zeros(num_of_iterations, dtype = np.float64)
+		self.origin_ys = np.zeros(num_of_iterations, dtype = np.float64)
+		self.unit_dir_xs = np.zeros(num_of_iterations, dtype = np.float64)
+		self.unit_dir_ys = np.zeros(num_of_iterations, dtype = np.float64)
+		self.norms = np.zeros(num_of_iterations, dtype = np.float64)
+
+		# flat per model and point buffers
+		size = num_of_iterations*max_num_of_points
+		self.votes = np.zeros(size, dtype = np.float64)
+		self.flat_buffers = [np.zeros(size, dtype = np.float64) for i in range(5)]
+
+		# model scores, and a vector of ones to sum the votes with
+		self.scores = np.zeros(num_of_iterations, dtype = np.float64)
+		self.ones = np.ones(max_num_of_points, dtype = np.float64)
+
+		# flat index layouts, built the first time each number of points is seen
+		self.layouts = {}
+
+	def _layout(self, num_of_points):
+		'''
+		Returns a 3-tuple of index arrays for the flat layout of num_of_points points:
+		the point index and the model index of every flat entry, and the flat offset of
+		every model.
+		'''
+		if num_of_points not in self.layouts:
+			self.layouts[num_of_points] = (
+				np.tile(np.arange(num_of_points), self.num_of_iterations),
+				np.repeat(np.arange(self.num_of_iterations), num_of_points),
+				np.arange(self.num_of_iterations)*num_of_points,
+			)
+		return self.layouts[num_of_points]
+
+	def fit(self, points, num_of_points):
+		'''
+		Fits a line model to the first num_of_points rows of points, a NumPy array of
+		shape (N, 2). The return is the same as ransac_line2d: the best Line object, or
+		None if no model got a positive score. At least two points are required.
+		'''
+		# draw the point pairs with the same random.shuffle calls as ransac_line2d
+		bag_of_indices = self.bag_of_indices
+		bag_of_indices[:] = range(num_of_points)
+		for iteration in range(self.num_of_iterations):
+			random.shuffle(bag_of_indices)
+			self.first_indices[iteration] = bag_of_indices[0]
+			self.second_indices[iteration] = bag_of_indices[1]
+
+		xs = self.xs[:num_of_points]
+		ys = self.ys[:num_of_points]
+		xs[...] = points[:num_of_points, 0]
+		ys[...] = points[:num_of_points, 1]
+
+		# define every model. the indices are always in range; mode 'clip' only keeps
+		# np.take from buffering its output
+		np.take(xs, self.first_indices, out = self.origin_xs, mode = 'clip')
+		np.take(ys, self.first_indices, out = self.origin_ys, mode = 'clip')
+		np.take(xs, self.second_indices, out = self.unit_dir_xs, mode = 'clip')
+		np.take(ys, self.second_indices, out = self.unit_dir_ys, mode = 'clip')
+		self.unit_dir_xs -= self.origin_xs
+		self.unit_dir_ys -= self.origin_ys
+		np.hypot(self.unit_dir_xs, self.unit_dir_ys, out = self.norms)
+		self.unit_dir_xs /= self.norms
+		self.unit_dir_ys /= self.norms
+
+		# spread the points and the models over the flat layout
+		point_indices, model_indices, model_offsets = self._layout(num_of_points)
+		size = self.num_of_iterations*num_of_points
+		votes = self.votes[:size]
+		point_xs, point_ys, origin_xs, origin_ys, unit_dir_xs = [buffer[:size] for buffer in self.flat_buffers]
+		np.take(xs, point_indices, out = point_xs, mode = 'clip')
+		np.take(ys, point_indices, out = point_ys, mode = 'clip')
+		np.take(self.origin_xs, model_indices, out = origin_xs, mode = 'clip')
+		np.take(self.origin_ys, model_indices, out = origin_ys, mode = 'clip')
+		np.take(self.unit_dir_xs, model_indices, out = unit_dir_xs, mode = 'clip')
+
+		# the distance of every point to every model is the magnitude of the cross
+		# product of the unit direction and the vector from the origin to the point
+		np.subtract(point_ys, origin_ys, out = votes)
+		votes *= unit_dir_xs
+		unit_dir_ys = origin_ys
+		np.take(self.unit_dir_ys, model_indices, out = unit_dir_ys, mode = 'clip')
+		point_xs -= origin_xs
+		point_xs *= unit_dir_ys
+		votes -= point_xs
+		np.abs(votes, out = votes)
+
+		# points within the tolerance vote with (tolerance - distance), the two points
+		# used to define a model do not vote for it
+		np.subtract(self.tolerance, votes, out = votes)
+		np.fmax(votes, 0.0, out = votes)
+		np.add(model_offsets, self.first_indices, out = self.vote_indices)
+		votes[self.vote_indices] = 0.0
+		np.add(model_offsets, self.second_indices, out = self.vote_indices)
+		votes[self.vote_indices] = 0.0
+		np.dot(votes.reshape(self.num_of_iterations, num_of_points), self.ones[:num_of_points], out = self.scores)
+
+		# the first model with the best score wins, as in ransac_line2d
+		best = int(np.argmax(self.scores))
+		if not self.scores[best] > 0:
+			return None
+
+		origin = np.matrix([[self.origin_xs[best]], [self.origin_ys[best]]])
+		unit_dir = np.matrix([[self.unit_dir_xs[best]], [self.unit_dir_ys[best]]])
+		return Line(origin, unit_dir)
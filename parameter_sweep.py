@@ -0,0 +1,329 @@
+#!/usr/bin/python
+
+'''
+This script is meant to be imported for its functionality. However, a standalone
+behavior does exist. It sweeps a grid of lane detection knobs (the Canny thresholds, the
+RANSAC iterations and tolerance, and the search strip geometry) over the homework 4 test
+sequence using a process pool and prints the configurations ranked by detection rate,
+drift stability, and time per frame.
+
+Jobs are made of one Canny setting, every configuration sharing that Canny setting, and
+a chunk of frames. Each job computes the Canny image of a frame once and runs every
+RANSAC and strip variation on it. Edge maps can additionally be saved to an edge cache
+directory keyed by frame and Canny setting so that later sweeps skip Canny entirely.
+RANSAC is reseeded for every configuration and frame, so a configuration's results do not
+depend on the rest of the grid or on how the jobs are split.
+
+EXAMPLE
+
+./cv python ./parameter_sweep.py
+
+LICENSE
+
+Copyright (c) 2012 Viet Nguyen
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+'''
+
+import hashlib
+import itertools
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import intrinsic_calibration
+import lane_detection
+from frame_processor import FrameProcessor
+
+# knobs of the Canny edge detector; configurations sharing these share edge maps
+CANNY_KEYS = ('low_threshold', 'ratio')
+
+# knobs passed on to lane_detection.define_hw4_search_strips
+STRIP_KEYS = ('vertical_interval', 'vertical_step', 'width_interval', 'left_center_interval', 'right_center_interval')
+
+# knobs passed on to line.ransac_line2d
+RANSAC_KEYS = ('num_of_iterations', 'tolerance')
+
+# the knobs used by lane_detection.detect_lanes and define_hw4_search_strips
+DEFAULT_CONFIG = {
+	'low_threshold': 100,
+	'ratio': 3,
+	'vertical_interval': (218, 368),
+	'vertical_step': 10,
+	'width_interval': (36, 120),
+	'left_center_interval': (205, -15),
+	'right_center_interval': (280, 440),
+	'num_of_iterations': 100,
+	'tolerance': 4.0,
+}
+
+def expand_grid(grid):
+	'''
+	Expands a parameter grid into a list of configurations. The grid is a dictionary
+	mapping knob names (see DEFAULT_CONFIG) to lists of values to try. Knobs that are not
+	in the grid keep their DEFAULT_CONFIG value. Each returned configuration is a
+	complete dictionary of knobs.
+	'''
+	for key in grid:
+		if key not in DEFAULT_CONFIG:
+			raise ValueError('Unknown sweep knob "{0}"!'.format(key))
+
+	keys = sorted(grid.keys())
+	configs = []
+	for values in itertools.product(*[grid[key] for key in keys]):
+		config = dict(DEFAULT_CONFIG)
+		config.update(zip(keys, values))
+		configs.append(config)
+	return configs
+
+def edge_cache_name(image_path, low_threshold, ratio):
+	'''
+	Returns the edge cache file name of the image at image_path for the given Canny
+	knobs. The name is keyed by the absolute path, size, and modification time of the
+	image, so frames of different drives with the same file name, or a frame that was
+	replaced, do not share an edge map.
+	'''
+	image_path = os.path.abspath(image_path)
+	image_stat = os.stat(image_path)
+	key = '{0}\n{1}\n{2!r}'.format(image_path, image_stat.st_size, image_stat.st_mtime)
+	return '{0}.{1}.canny_{2}_{3}.npy'.format(
+		os.path.basename(image_path),
+		hashlib.sha1(key.encode('utf-8')).hexdigest()[:16],
+		low_threshold,
+		ratio,
+	)
+
+def load_edge_map(image_path, low_threshold, ratio, edge_cache_dir = None):
+	'''
+	Returns the Canny image of the image at image_path for the given Canny knobs, or None
+	if the image cannot be read. If edge_cache_dir is not None, the edge map is read from
+	(or, on a miss, written to) a .npy file in that directory named by edge_cache_name.
+	The file is written under a temporary name and then renamed into place, so an
+	interrupted sweep never leaves a truncated edge map behind; an unreadable cache file
+	is computed again.
+	'''
+	if not os.path.isfile(image_path):
+		return None
+
+	cache_path = None
+	if edge_cache_dir != None:
+		cache_path = os.path.join(edge_cache_dir, edge_cache_name(image_path, low_threshold, ratio))
+		if os.path.exists(cache_path):
+			try:
+				return np.load(cache_path)
+			except (IOError, EOFError, ValueError):
+				pass
+
+	cv_image = cv2.imread(image_path)
+	if cv_image is None:
+		return None
+	canny_image = cv2.Canny(cv_image, low_threshold, low_threshold*ratio)
+
+	if cache_path != None:
+		cache_file = tempfile.NamedTemporaryFile(dir = edge_cache_dir, suffix = '.tmp', delete = False)
+		try:
+			with cache_file:
+				np.save(cache_file, canny_image)
+			os.replace(cache_file.name, cache_path)
+		except:
+			os.remove(cache_file.name)
+			raise
+
+	return canny_image
+
+def make_sweep_jobs(configs, image_paths, intrinsic_matrix, distortion_coefficients, chunk_size = 32, edge_cache_dir = None):
+	'''
+	Splits the sweep into jobs for run_sweep_job. Configurations are grouped by their
+	Canny knobs and the frames are split into chunks of chunk_size frames; there is one
+	job per (Canny group, frame chunk) pair. Returns the list of jobs.
+	'''
+	canny_groups = {}
+	for config_id, config in enumerate(configs):
+		canny_setting = tuple([config[key] for key in CANNY_KEYS])
+		canny_groups.setdefault(canny_setting, []).append((config_id, config))
+
+	jobs = []
+	for canny_setting in sorted(canny_groups.keys()):
+		for chunk_start in range(0, len(image_paths), chunk_size):
+			frames = list(enumerate(image_paths))[chunk_start:chunk_start+chunk_size]
+			jobs.append((
+				len(jobs),
+				canny_setting,
+				canny_groups[canny_setting],
+				frames,
+				intrinsic_matrix,
+				distortion_coefficients,
+				edge_cache_dir,
+			))
+	return jobs
+
+def run_sweep_job(job):
+	'''
+	Runs a single sweep job as created by make_sweep_jobs. Returns a list of 5-tuples,
+	one per (configuration, frame) pair, containing the configuration index, the frame
+	index, the lanes found flag, the horizontal drift (None if the lanes or the pose were
+	not found), and the processing time in seconds including the Canny time. Frames that
+	cannot be read count as lanes not found.
+	'''
+	job_index, canny_setting, group, frames, intrinsic_matrix, distortion_coefficients, edge_cache_dir = job
+	low_threshold, ratio = canny_setting
+
+	# build one frame processor per configuration so buffers are reused across frames
+	processors = []
+	for config_id, config in group:
+		left_search_strips, right_search_strips = lane_detection.define_hw4_search_strips(
+			**dict([(key, config[key]) for key in STRIP_KEYS]))
+		processor = FrameProcessor(
+			left_search_strips,
+			right_search_strips,
+			low_threshold,
+			ratio,
+			num_of_iterations = config['num_of_iterations'],
+			tolerance = config['tolerance'],
+		)
+		processors.append((config_id, processor))
+	group_configs = dict(group)
+
+	results = []
+	for frame_index, image_path in frames:
+
+		# the edge map is shared by every configuration in the group
+		start_time = time.time()
+		canny_image = load_edge_map(image_path, low_threshold, ratio, edge_cache_dir)
+		canny_time = time.time()-start_time
+
+		if canny_image is None:
+			for config_id, processor in processors:
+				results.append((config_id, frame_index, False, None, canny_time))
+			continue
+
+		for config_id, processor in processors:
+			start_time = time.time()
+
+			# seed RANSAC from the configuration and the frame only, so the result does
+			# not depend on which other configurations share the job. a string seed is
+			# hashed the same way in every process
+			random.seed('{0!r} {1}'.format(sorted(group_configs[config_id].items()), frame_index))
+
+			lanes_found, left_lane_line, right_lane_line, vanishing_point = \
+				processor.detect_lanes_in_edges(canny_image)
+
+			horizontal_drift = None
+			if lanes_found:
+				pnp_success, rotation_omega, translate = processor.estimate_pose(
+					left_lane_line,
+					right_lane_line,
+					intrinsic_matrix,
+					distortion_coefficients,
+				)
+				if pnp_success:
+					horizontal_drift = processor.horizontal_drift()
+
+			elapsed = time.time()-start_time+canny_time
+			results.append((config_id, frame_index, lanes_found, horizontal_drift, elapsed))
+
+	return results
+
+def summarize_sweep(configs, results):
+	'''
+	Aggregates the per-frame results of all sweep jobs into one summary per
+	configuration. Returns a list of dictionaries, ranked best first, each containing
+	the configuration, the detection_rate (fraction of frames with lanes found), the
+	drift_jitter (mean absolute change in horizontal drift between consecutive frames
+	with a pose, lower is more stable), and the time_per_frame in seconds.
+	'''
+	per_config = [[] for config in configs]
+	for config_id, frame_index, lanes_found, horizontal_drift, elapsed in results:
+		per_config[config_id].append((frame_index, lanes_found, horizontal_drift, elapsed))
+
+	summaries = []
+	for config_id, config in enumerate(configs):
+		frame_results = sorted(per_config[config_id])
+		num_of_frames = len(frame_results)
+
+		drifts = [drift for frame_index, lanes_found, drift, elapsed in frame_results if drift != None]
+		drift_changes = [abs(b-a) for a, b in zip(drifts[:-1], drifts[1:])]
+
+		summaries.append({
+			'config': config,
+			'detection_rate': sum([1 for result in frame_results if result[1]])/float(max(num_of_frames, 1)),
+			'drift_jitter': sum(drift_changes)/len(drift_changes) if drift_changes else float('inf'),
+			'time_per_frame': sum([result[3] for result in frame_results])/float(max(num_of_frames, 1)),
+		})
+
+	summaries.sort(key = lambda summary: (-summary['detection_rate'], summary['drift_jitter'], summary['time_per_frame']))
+	return summaries
+
+def run_sweep(image_paths, grid, intrinsic_matrix, distortion_coefficients, processes = None, chunk_size = 32, edge_cache_dir = None):
+	'''
+	Runs a parameter sweep of the given grid (see expand_grid) over the images in
+	image_paths using a process pool of the given number of processes (defaulting to the
+	number of CPUs). Returns the ranked summaries from summarize_sweep.
+	'''
+	if edge_cache_dir != None and not os.path.isdir(edge_cache_dir):
+		os.makedirs(edge_cache_dir)
+
+	configs = expand_grid(grid)
+	jobs = make_sweep_jobs(configs, image_paths, intrinsic_matrix, distortion_coefficients, chunk_size, edge_cache_dir)
+
+	pool = multiprocessing.Pool(processes)
+	try:
+		results = []
+		for job_results in pool.imap_unordered(run_sweep_job, jobs):
+			results.extend(job_results)
+	finally:
+		pool.close()
+		pool.join()
+
+	return summarize_sweep(configs, results)
+
+def hw4_parameter_sweep():
+	'''
+	Sweeps a small grid of knobs around the homework 4 defaults over the homework 4 test
+	sequence and prints the ranked configurations.
+	'''
+	image_paths = ['LDWS_test/LDWS_test_data {0:03}.bmp'.format(x) for x in range(1, 609)]
+
+	intrinsic_matrix, distortion_coefficients = intrinsic_calibration.hw4_calibration(False)
+
+	grid = {
+		'low_threshold': [50, 100, 150],
+		'ratio': [2, 3],
+		'num_of_iterations': [50, 100],
+		'tolerance': [2.0, 4.0],
+		'vertical_step': [5, 10],
+	}
+
+	summaries = run_sweep(image_paths, grid, intrinsic_matrix, distortion_coefficients, edge_cache_dir = 'edge_cache')
+
+	for rank, summary in enumerate(summaries):
+		knobs = ', '.join(['{0}={1!r}'.format(key, summary['config'][key]) for key in sorted(grid.keys())])
+		print('{0:3}: detection {1:.3f}, jitter {2:.4f}, {3:.2f} ms/frame: {4}'.format(
+			rank+1,
+			summary['detection_rate'],
+			summary['drift_jitter'],
+			summary['time_per_frame']*1000.0,
+			knobs,
+		))
+
+if __name__ == '__main__':
+	hw4_parameter_sweep()